@@ -0,0 +1,37 @@
+# Benchmark of content adaptive per-tile iteration budgets
+#
+# Stylizes a content image with the gatys tiling strategy twice, once running the same iterations on every tile and
+# once distributing a reduced budget of iterations according to the detail of each tile, and reports the GPU time
+# of each run and the RMSE between both results. Requires a GPU.
+#
+# Usage: python benchmarks/iterations.py CONTENT STYLE [--size SIZE] [--iterbudget FRACTION] [--tileoverlap OVERLAP]
+import argparse
+import numpy as np
+from tempfile import TemporaryDirectory
+from neuralstyle.algorithms import styletransfer
+from neuralstyle.imagemagick import readimage
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GPU time saved by per-tile iteration budgets")
+    parser.add_argument("content")
+    parser.add_argument("style")
+    parser.add_argument("--size", type=int, default=None)
+    parser.add_argument("--iterbudget", type=float, default=0.7)
+    parser.add_argument("--tileoverlap", type=int, default=100)
+    args = parser.parse_args()
+
+    results = {}
+    for iterbudget in [None, args.iterbudget]:
+        tmpdir = TemporaryDirectory()
+        job = styletransfer([args.content], [args.style], tmpdir.name, size=args.size, alg="gatys",
+                            tileoverlap=args.tileoverlap, iterbudget=iterbudget)[0]
+        results[iterbudget] = readimage(job.outfile).astype(float)
+        print("%-16s %4d tiles %10.1f GPU s" % ("uniform" if iterbudget is None else "budget %.2f" % iterbudget,
+                                               job.tiles, job.gpuseconds))
+    rmse = np.sqrt(((results[None] - results[args.iterbudget]) ** 2).mean())
+    print("RMSE between results: %.2f (8-bit scale)" % rmse)
+
+
+if __name__ == "__main__":
+    main()
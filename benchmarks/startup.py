@@ -0,0 +1,49 @@
+# Benchmark of startup latency
+#
+# Measures, in fresh processes, the time taken to import the style transfer module and the time until the tiling of
+# a first job is decided, which requires knowing the available devices. Then measures the time taken to decide the
+# tiling of a grid of many jobs. No style transfer is run, so this benchmark does not require a GPU, though the
+# results are only meaningful in a machine with GPUs, where probing them is expensive.
+#
+# Usage: python benchmarks/startup.py [--runs RUNS] [--jobs JOBS]
+import argparse
+import json
+import subprocess
+import sys
+
+PROBE = """
+import json, time
+start = time.perf_counter()
+import neuralstyle.algorithms as algorithms
+imported = time.perf_counter()
+algorithms.fitsingletile([3000, 2000], "gatys")
+algorithms.tilegeometry([3000, 2000], "gatys", 100)
+firstjob = time.perf_counter()
+for _ in range(%d):
+    algorithms.fitsingletile([3000, 2000], "gatys")
+    algorithms.tilegeometry([3000, 2000], "gatys", 100)
+grid = time.perf_counter()
+print(json.dumps({"import": imported - start, "firstjob": firstjob - imported, "grid": grid - firstjob}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import and first job latency")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--jobs", type=int, default=100)
+    args = parser.parse_args()
+
+    results = []
+    for _ in range(args.runs):
+        output = subprocess.run([sys.executable, "-c", PROBE % args.jobs], check=True, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL)
+        results.append(json.loads(output.stdout.decode("utf-8").strip().splitlines()[-1]))
+
+    for key, description in [("import", "import"), ("firstjob", "first job tiling"),
+                             ("grid", "tiling of %d more jobs" % args.jobs)]:
+        times = sorted(result[key] for result in results)
+        print("%-30s median %8.1f ms   min %8.1f ms" % (description, 1000 * times[len(times) // 2], 1000 * times[0]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+# Benchmark of warm started style weight and scale sweeps
+#
+# Runs the same grid of style weights and scales over a content and style image twice, once running every
+# combination from scratch and once as a warm started sweep, and reports the time taken by each. Requires a GPU.
+#
+# Usage: python benchmarks/sweep.py CONTENT STYLE [--size SIZE] [--sw WEIGHT ...] [--ss SCALE ...]
+import argparse
+import time
+from tempfile import TemporaryDirectory
+from neuralstyle.algorithms import styletransfer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time saved by warm started sweeps")
+    parser.add_argument("content")
+    parser.add_argument("style")
+    parser.add_argument("--size", type=int, default=None)
+    parser.add_argument("--sw", type=float, nargs="+", default=[1.0, 2.5, 5.0, 10.0, 20.0])
+    parser.add_argument("--ss", type=float, nargs="+", default=[1.0])
+    args = parser.parse_args()
+
+    times = {}
+    for sweep in [False, True]:
+        tmpdir = TemporaryDirectory()
+        start = time.perf_counter()
+        jobs = styletransfer([args.content], [args.style], tmpdir.name, size=args.size, alg="gatys",
+                             weights=args.sw, stylescales=args.ss, sweep=sweep)
+        times[sweep] = time.perf_counter() - start
+        print("%-12s %4d variants %10.1f s wall %10.1f GPU s" % ("sweep" if sweep else "from scratch", len(jobs),
+                                                                 times[sweep], sum(j.gpuseconds for j in jobs)))
+    print("Speedup: %.2fx" % (times[False] / times[True]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# Benchmark of the GPU pixels saved by seam-aware adaptive tile overlaps
+#
+# For each content image, computes the tiling used by neuraltile at the given size, both with uniform overlaps and
+# with content adaptive overlaps, and reports the number of pixels that must be stylized in each case. No style
+# transfer is run, so this benchmark does not require a GPU.
+#
+# Usage: python benchmarks/tileoverlap.py [--size SIZE] [--alg ALGORITHM] [--tileoverlap OVERLAP] IMAGE [IMAGE ...]
+import argparse
+from tempfile import TemporaryDirectory
+from neuralstyle.algorithms import targetshape, tilegeometry
+from neuralstyle.imagemagick import convert, resize, readimage
+from neuralstyle.seams import adaptivetiles
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GPU pixels saved by adaptive tile overlaps")
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--size", type=int, default=None)
+    parser.add_argument("--alg", default="gatys")
+    parser.add_argument("--tileoverlap", type=int, default=100)
+    args = parser.parse_args()
+
+    totaluniform = totaladaptive = 0
+    print("%-40s %8s %14s %14s %8s" % ("image", "tiles", "uniform px", "adaptive px", "saved"))
+    for image in args.images:
+        fullshape = targetshape(image, args.size)
+        xtiles, ytiles = tilegeometry(fullshape, args.alg, args.tileoverlap)
+        # Uniform tiling, as produced by choptiles
+        uniform = (fullshape[0] + (xtiles - 1) * args.tileoverlap) * (fullshape[1] + (ytiles - 1) * args.tileoverlap)
+        # Adaptive tiling
+        workdir = TemporaryDirectory()
+        resized = workdir.name + "/resized.png"
+        convert(image, resized)
+        resize(resized, fullshape)
+        boxes, _ = adaptivetiles(readimage(resized), xtiles, ytiles, args.tileoverlap)
+        adaptive = sum(w * h for _, _, w, h in boxes)
+        print("%-40s %8s %14d %14d %7.2f%%" % (image, "%dx%d" % (xtiles, ytiles), uniform, adaptive,
+                                               100.0 * (uniform - adaptive) / uniform))
+        totaluniform += uniform
+        totaladaptive += adaptive
+
+    print("Total GPU pixels saved: %d (%.2f%%)" % (totaluniform - totaladaptive,
+                                                  100.0 * (totaluniform - totaladaptive) / totaluniform))
+
+
+if __name__ == "__main__":
+    main()
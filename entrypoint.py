@@ -1,8 +1,13 @@
 # Main entrypoint script to the neural-style app
 import sys
+import json
 import traceback
 import logging
-from neuralstyle.algorithms import styletransfer
+from neuralstyle.algorithms import styletransfer, tiletask
+from neuralstyle.distributed import work
+from neuralstyle.devices import override
+from neuralstyle.outputs import parseoutput
+from neuralstyle.planner import makeplan, writeplan, loadplan
 from neuralstyle.utils import sublist
 
 logging.basicConfig(level=logging.INFO)
@@ -17,6 +22,8 @@ neural-style-docker: artistic style between images
     --size SIZE: size of the output image. Default: content image size
     --sw STYLE_WEIGHT (default 5): weight or list of weights of the style over the content, in range (0, inf)
     --ss STYLE_SCALE (default 1.0): scaling or list of scaling factors for the style images
+    --sweep: when several style weights or scales are given, warm start each combination from the result of a
+        neighbouring one, running fewer iterations. Only available for the gatys algorithm
     --alg ALGORITHM: style-transfer algorithm to use. Must be one of the following:
         gatys                   Highly detailed transfer, slow processing times (default)
         gatys-multiresolution   Multipass version of Gatys method, provides even better quality
@@ -24,6 +31,40 @@ neural-style-docker: artistic style between images
         chen-schmidt-inverse    Even faster aproximation to chen-schmidt through the use of an inverse network
     --tileoverlap TILE_OVERLAP: overlap of tiles in the style transfer, measured in pixels. If you experience
         artifacts in the image you should try increasing this. Default: 100
+    --adaptiveoverlap: choose the overlap of each pair of tiles from the image content, up to TILE_OVERLAP pixels,
+        and blend tiles along minimum error seams. Allows for smaller overlaps, thus less computation
+    --iterbudget FRACTION: when tiling with the gatys algorithm, distribute iterations among tiles according to
+        their amount of detail, running in total this fraction of the iterations of a uniform allocation (e.g. 0.7)
+    --outputs OUTPUT_SPECS: additional variants in which to save each result, each one given as
+        FORMAT[:qQUALITY][:maxMAXSIZE][:noalpha], e.g. "--outputs jpg:q85 webp:q80:max512" to get a web JPEG and a
+        WebP thumbnail of at most 512 pixels. Alpha channels are flattened over white when using noalpha, or for
+        formats that do not support them
+    --checkpoints CHECKPOINTS_FOLDER: save the progress of tiled and gatys-multiresolution jobs in this folder, so that
+        running again an interrupted job continues from its first unfinished tile or step. The progress of a job is
+        removed once it finishes
+    --dedup: detect duplicated content and style images (same pixels under different names or formats), running each
+        distinct combination once and copying its result to the duplicates. Results of previous runs over the same
+        images and options are also reused
+    --perceptual: as --dedup, but also detect near-duplicated images (e.g. re-encoded or resized) through a perceptual
+        hash
+    --ledger LEDGER_FILE: JSONL file to which the resources consumed by each job (GPU and CPU seconds, tiles,
+        multiresolution steps, peak temporary disk usage, cache hits) are appended
+    --metrics METRICS_FILE: file in which to write the aggregated job metrics in Prometheus text format, e.g. for
+        the node-exporter textfile collector
+    --plan PLAN_FILE: do not run any style transfer, instead write to PLAN_FILE a JSON plan listing every job, its
+        tiling layout, number of algorithm passes and its estimated runtime, GPU memory and disk usage
+    --costmodel COSTMODEL_FILE: JSON file with the cost model to use for the estimates in --plan
+    --fromplan PLAN_FILE: run the jobs in the order they appear in the given plan
+    --sharedir SHARED_FOLDER: folder shared with worker containers. Tiles of large images are published in this
+        folder to be processed by the workers, and blended once all of them are ready
+    --worker: run as a worker, processing the tiles published in the folder given by --sharedir instead of running
+        any style transfer job. No content or style images are needed in this mode
+    --idletimeout SECONDS: when running as a worker, stop after this many seconds without finding tiles to process.
+        Default: run forever
+    --devices DEVICES: do not probe the GPUs in the system, use instead the given devices. Use "cpu" to run without
+        GPUs (only for the gatys algorithm, very slow), or a comma-separated list of GPU models and memory in MB,
+        e.g. "Tesla K80:11439", to plan jobs for a different machine. Can also be set through the
+        NEURALSTYLE_DEVICES environment variable
 
     Additionally provided parameters are carried on to the underlying algorithm.
     
@@ -43,6 +84,21 @@ def main(argv=None):
         weights = None
         stylescales = None
         tileoverlap = None
+        adaptiveoverlap = False
+        iterbudget = None
+        sweep = False
+        outputs = None
+        checkpointdir = None
+        dedup = False
+        perceptual = False
+        ledger = None
+        metricsfile = None
+        planfile = None
+        costmodel = None
+        plan = None
+        sharedir = None
+        worker = False
+        idletimeout = None
         otherparams = []
 
         # Gather parameters
@@ -71,9 +127,59 @@ def main(argv=None):
             elif argv[i] == "--ss":
                 stylescales = [float(x) for x in sublist(argv[i+1:], stopper="-")]
                 i += len(stylescales) + 1
+            elif argv[i] == "--sweep":
+                sweep = True
+                i += 1
             elif argv[i] == "--tileoverlap":
                 tileoverlap = int(argv[i+1])
                 i += 2
+            elif argv[i] == "--adaptiveoverlap":
+                adaptiveoverlap = True
+                i += 1
+            elif argv[i] == "--iterbudget":
+                iterbudget = float(argv[i+1])
+                i += 2
+            elif argv[i] == "--outputs":
+                outputs = [parseoutput(x) for x in sublist(argv[i+1:], stopper="-")]
+                i += len(outputs) + 1
+            elif argv[i] == "--checkpoints":
+                checkpointdir = "/images/" + argv[i+1]
+                i += 2
+            elif argv[i] == "--dedup":
+                dedup = True
+                i += 1
+            elif argv[i] == "--perceptual":
+                dedup = True
+                perceptual = True
+                i += 1
+            elif argv[i] == "--ledger":
+                ledger = "/images/" + argv[i+1]
+                i += 2
+            elif argv[i] == "--metrics":
+                metricsfile = "/images/" + argv[i+1]
+                i += 2
+            elif argv[i] == "--plan":
+                planfile = "/images/" + argv[i+1]
+                i += 2
+            elif argv[i] == "--costmodel":
+                with open("/images/" + argv[i+1]) as f:
+                    costmodel = json.load(f)
+                i += 2
+            elif argv[i] == "--sharedir":
+                sharedir = "/images/" + argv[i+1]
+                i += 2
+            elif argv[i] == "--worker":
+                worker = True
+                i += 1
+            elif argv[i] == "--idletimeout":
+                idletimeout = float(argv[i+1])
+                i += 2
+            elif argv[i] == "--devices":
+                override(argv[i+1])
+                i += 2
+            elif argv[i] == "--fromplan":
+                plan = loadplan("/images/" + argv[i+1])
+                i += 2
             # Help
             elif argv[i] == "--help":
                 print(HELP)
@@ -83,21 +189,46 @@ def main(argv=None):
                 otherparams.append(argv[i])
                 i += 1
 
+        # Worker mode
+        if worker:
+            if sharedir is None:
+                raise ValueError("A shared folder must be provided through --sharedir to run as a worker")
+            LOGGER.info("Running as worker over shared folder %s" % sharedir)
+            work(sharedir, tiletask, idletimeout=idletimeout)
+            return 1
+
         # Check parameters
         if len(contents) == 0:
             raise ValueError("At least one content image must be provided")
         if len(styles) == 0:
             raise ValueError("At least one style image must be provided")
 
+        if planfile is not None:
+            plan = makeplan(contents, styles, savefolder, size, alg, weights, stylescales, tileoverlap,
+                            algparams=otherparams, sweep=sweep, costmodel=costmodel, batch=sharedir is None,
+                            iterbudget=iterbudget)
+            writeplan(plan, planfile)
+            LOGGER.info("Plan saved to %s: %s" % (planfile, str(plan["totals"])))
+            return 1
+
         LOGGER.info("Running neural style transfer with")
         LOGGER.info("\tContents = %s" % str(contents))
         LOGGER.info("\tStyle = %s" % str(styles))
         LOGGER.info("\tAlgorithm = %s" % alg)
         LOGGER.info("\tStyle weights = %s" % str(weights))
         LOGGER.info("\tStyle scales = %s" % str(stylescales))
+        LOGGER.info("\tWarm started sweep = %s" % str(sweep))
         LOGGER.info("\tSize = %s" % str(size))
         LOGGER.info("\tTile overlap = %s" % str(tileoverlap))
-        styletransfer(contents, styles, savefolder, size, alg, weights, stylescales, tileoverlap, algparams=otherparams)
+        LOGGER.info("\tAdaptive overlap = %s" % str(adaptiveoverlap))
+        LOGGER.info("\tIteration budget = %s" % str(iterbudget))
+        LOGGER.info("\tOutput variants = %s" % str(outputs))
+        LOGGER.info("\tCheckpoints folder = %s" % str(checkpointdir))
+        LOGGER.info("\tDeduplication = %s" % ("perceptual" if perceptual else str(dedup)))
+        styletransfer(contents, styles, savefolder, size, alg, weights, stylescales, tileoverlap, algparams=otherparams,
+                      ledger=ledger, metricsfile=metricsfile, adaptiveoverlap=adaptiveoverlap,
+                      sweep=sweep, plan=plan, sharedir=sharedir, iterbudget=iterbudget,
+                      outputs=outputs, checkpointdir=checkpointdir, dedup=dedup, perceptual=perceptual)
         return 1
 
     except Exception:
@@ -1,16 +1,26 @@
 # Callers to neural style algorithms
-from subprocess import call
+from subprocess import run, PIPE
 from itertools import product
 from tempfile import TemporaryDirectory, NamedTemporaryFile
 from shutil import copyfile
+import os
+import sys
+from os import mkdir
+from os.path import isfile, expanduser, dirname, basename, join
+from collections import OrderedDict
 import logging
+import time
 from math import ceil
 import numpy as np
 import json
-import GPUtil
 from neuralstyle.utils import filename, fileext
-from neuralstyle.imagemagick import (convert, resize, shape, assertshape, choptiles, feather, smush, composite,
-                                     extractalpha, mergealpha)
+from neuralstyle import metrics, distributed, checkpoints, fingerprints
+from neuralstyle.outputs import encodeoutputs, checkoutputs
+from neuralstyle.devices import gpuname, gpuconfig, CPUNAME
+from neuralstyle.imagemagick import (convert, resize, shape, assertshape, choptiles, croptiles, feather, smush,
+                                     composite, extractalpha, mergealpha, readimage, writeimage)
+from neuralstyle.seams import adaptivetiles, quilt
+from neuralstyle.budgets import tiledetail, allocateiterations
 
 logging.basicConfig(level=logging.INFO)
 LOGGER = logging.getLogger(__name__)
@@ -50,14 +60,209 @@ ALGORITHMS = {
     }
 }
 
-# Load file with GPU configuration
-with open("gpuconfig.json", "r") as f:
-    GPUCONFIG = json.load(f)
+# Multiresolution strategy: list of rounds, each round composed of a optimization method and a number of
+# upresolution steps.
+# Using "adam" as optimizer means that Adam will be used when necessary to attain higher resolutions
+MULTIRESOLUTION_STRATEGY = [
+    ["lbfgs", 7],
+    ["lbfgs", 7],
+    ["lbfgs", 7],
+    ["lbfgs", 7],
+    ["lbfgs", 7]
+]
+
+# Fraction of the iterations of a regular Gatys run used when warm starting from a neighbouring result in a sweep
+SWEEP_ITERFRACTION = 0.3
+# Minimum number of iterations of a warm started Gatys run
+SWEEP_MINITERS = 50
+
+# Messages of the style transfer algorithms that reveal an out of GPU memory error
+OOM_PATTERNS = ["out of memory", "CUDNN_STATUS_ALLOC_FAILED", "CUBLAS_STATUS_ALLOC_FAILED", "cuda runtime error (2)"]
+# Number of retries with smaller tiles after running out of GPU memory
+OOM_RETRIES = 3
+# Factor by which tile sizes are shrunk after running out of GPU memory
+OOM_SHRINK = 0.8
+# Seconds to wait before the first retry after running out of GPU memory, doubling after each retry up to a maximum
+OOM_BACKOFF = 5
+OOM_MAXBACKOFF = 60
+# File where the tile size limits learned after running out of GPU memory are recorded
+TILELIMITS_FILE = os.environ.get("NEURALSTYLE_TILELIMITS", expanduser("~/.neuralstyle/tilelimits.json"))
+TILELIMITS = None
+
+
+class AlgorithmError(RuntimeError):
+    """A style transfer algorithm failed to run"""
+    pass
+
+
+class OutOfMemoryError(AlgorithmError):
+    """A style transfer algorithm ran out of GPU memory"""
+    pass
 
 
 def styletransfer(contents, styles, savefolder, size=None, alg="gatys", weights=None, stylescales=None,
-                  tileoverlap=100, algparams=None):
-    """General style transfer routine over multiple sets of options"""
+                  tileoverlap=100, algparams=None, ledger=None, metricsfile=None, adaptiveoverlap=False,
+                  sweep=False, plan=None, batch=True, sharedir=None, iterbudget=None, outputs=None,
+                  checkpointdir=None, dedup=False, perceptual=False):
+    """General style transfer routine over multiple sets of options
+
+    Returns a list of JobMetrics objects, one per combination of options, with the resources consumed by each job.
+    If a ledger file is given, the metrics of each job are appended to it as a JSON line as soon as the job finishes.
+    If a metrics file is given, the aggregated metrics are written to it in Prometheus text format.
+
+    If adaptiveoverlap is True, tiled images use a seam-aware tiling in which tileoverlap is the maximum overlap.
+
+    If sweep is True, the combinations of weights and scales for each content and style are run in an order in which
+    consecutive combinations are neighbours, and each run is warm started from the result of the previous one with a
+    reduced number of iterations. Only available for the gatys algorithm.
+
+    If a plan produced by neuralstyle.planner.makeplan is given, jobs are run in the order they appear in the plan.
+
+    If batch is True, Chen-Schmidt jobs sharing style, scale and width are run through a single invocation of the
+    algorithm.
+
+    If a sharedir is given, the tiles of tiled jobs are published in that shared folder, to be processed by any
+    number of workers (see neuralstyle.distributed.work). Chen-Schmidt jobs are not batched in this mode.
+
+    If an iterbudget is given, the gatys iterations of tiled images are distributed among tiles according to their
+    amount of detail, with a total of iterbudget times the iterations of running every tile in full.
+
+    If a list of output specs is given (see neuralstyle.outputs), each result is also encoded into those variants.
+
+    If a checkpointdir is given, the progress of tiled and gatys-multiresolution jobs is saved in workspaces inside
+    that folder, and rerunning an interrupted job resumes it from its first unfinished tile or step. Completed jobs
+    are also recorded there, and skipped when rerun as long as their results are unmodified.
+
+    If dedup is True, contents and styles are fingerprinted by their pixels (and by a perceptual hash if perceptual
+    is True), jobs over duplicated inputs are run once and their result copied, and results produced in previous runs
+    for the same inputs and options are reused (see neuralstyle.fingerprints).
+    """
+    weights, stylescales, tileoverlap, algparams, sweep = plugdefaults(alg, weights, stylescales, tileoverlap,
+                                                                       algparams, sweep)
+    if checkpointdir is not None:
+        checkpoints.collectgarbage(checkpointdir)
+    grid = jobgrid(contents, styles, savefolder, alg, weights, stylescales, sweep)
+    if plan is not None:
+        grid = planorder(grid, plan)
+    # Bad output specs are reported before running anything
+    if outputs:
+        for spec in grid:
+            checkoutputs(spec["outfile"], outputs)
+
+    # Jobs already completed in a previous run are skipped
+    jobs = []
+    jobparams = {"alg": alg, "size": size, "tileoverlap": tileoverlap, "algparams": [str(p) for p in algparams],
+                 "adaptiveoverlap": adaptiveoverlap, "sweep": sweep, "iterbudget": iterbudget}
+    if checkpointdir is not None:
+        pending = []
+        for spec in grid:
+            if checkpoints.jobcomplete(checkpointdir, "job", completionparams(spec, jobparams), spec["outfile"]):
+                LOGGER.info("Job %s was completed in a previous run, skipping it" % spec["outfile"])
+                jobs.append(finishjob(copyresult(spec, spec["outfile"], alg, size), outputs, ledger))
+            else:
+                pending.append(spec)
+        grid = pending
+
+    # Jobs over duplicated inputs, or already run in previous runs, are served by copying results
+    duplicates = []
+    if dedup:
+        grid, duplicates = fingerprints.dedupgrid(grid, perceptual)
+        pending = []
+        for spec in grid:
+            previous = fingerprints.previousresult(spec, jobparams)
+            if previous is not None:
+                LOGGER.info("Reusing result %s from a previous run" % previous)
+                jobs.append(finishjob(copyresult(spec, previous, alg, size), outputs, ledger))
+            else:
+                pending.append(spec)
+        grid = pending
+
+    # Chen-Schmidt jobs are run all together
+    if batch and sharedir is None and alg in ["chen-schmidt", "chen-schmidt-inverse"]:
+        if checkpointdir is not None:
+            LOGGER.warning("Batched Chen-Schmidt jobs only record whole jobs as complete, the progress of tiles is not "
+                           "saved. Disable batching to resume interrupted tiled jobs")
+        finished = zip(grid, chenschmidt_grid(grid, size, alg, tileoverlap, algparams, adaptiveoverlap))
+    else:
+        finished = ((spec, runjob(spec, size, alg, algparams, tileoverlap, adaptiveoverlap, sharedir, iterbudget,
+                                  checkpointdir)) for spec in grid)
+    for spec, job in finished:
+        # Results are recorded as soon as each job finishes, so that they are reused even if a later job fails
+        if checkpointdir is not None:
+            checkpoints.markjobcomplete(checkpointdir, "job", completionparams(spec, jobparams), spec["outfile"])
+        if dedup:
+            fingerprints.recordresult(spec, jobparams)
+        jobs.append(finishjob(job, outputs, ledger))
+
+    if dedup:
+        for spec, original in duplicates:
+            jobs.append(finishjob(copyresult(spec, original["outfile"], alg, size), outputs, ledger))
+
+    if metricsfile is not None:
+        metrics.writeprometheus(metricsfile, jobs)
+    return jobs
+
+
+def runjob(spec, size, alg, algparams, tileoverlap, adaptiveoverlap, sharedir, iterbudget, checkpointdir):
+    """Runs a style transfer job from a job grid, returning its metrics"""
+    content, style, outfile = spec["content"], spec["style"], spec["outfile"]
+    # Warm start only from results that are available
+    initimage = spec["initimage"] if spec["initimage"] is not None and isfile(spec["initimage"]) else None
+    job = metrics.JobMetrics(outfile, content, style, alg, spec["weight"], spec["stylescale"])
+    with metrics.trackjob(job):
+        styletransfer_fit(content=content, style=style, outfile=outfile, size=size, alg=alg,
+                          weight=spec["weight"], stylescale=spec["stylescale"], algparams=algparams,
+                          overlap=tileoverlap, adaptiveoverlap=adaptiveoverlap, initimage=initimage,
+                          sharedir=sharedir, iterbudget=iterbudget, checkpointdir=checkpointdir)
+    return job
+
+
+def completionparams(spec, jobparams):
+    """Returns the parameters identifying a job from a job grid in the records of complete jobs"""
+    return dict(jobparams, content=checkpoints.filedigest(spec["content"]), style=checkpoints.filedigest(spec["style"]),
+                weight=spec["weight"], stylescale=spec["stylescale"], outfile=os.path.abspath(spec["outfile"]))
+
+
+def finishjob(job, outputs=None, ledger=None):
+    """Completes a finished job by encoding its output variants, and reporting its metrics"""
+    if outputs:
+        encodevariants(job, outputs)
+    LOGGER.info("Job %s finished: %s" % (job.outfile, str(job.asdict())))
+    if ledger is not None:
+        metrics.appendledger(ledger, job)
+    return job
+
+
+def copyresult(spec, source, alg, size=None):
+    """Produces the result of a job by copying the result of an equivalent job, returning the metrics of the job
+
+    The copy is brought to the shape of the job content, in case it was a near duplicate with a different shape.
+    """
+    job = metrics.JobMetrics(spec["outfile"], spec["content"], spec["style"], alg, spec["weight"],
+                             spec["stylescale"])
+    with metrics.trackjob(job):
+        if os.path.abspath(source) != os.path.abspath(spec["outfile"]):
+            if fileext(source) == fileext(spec["outfile"]):
+                copyfile(source, spec["outfile"])
+            else:
+                convert(source, spec["outfile"])
+            correctshape(spec["outfile"], spec["content"], size)
+        metrics.record(cachehits=1)
+    return job
+
+
+def encodevariants(job, outputs):
+    """Encodes the result of a finished job into the given output variants, recording them in the job metrics"""
+    start = time.perf_counter()
+    job.outputs.extend(encodeoutputs(job.outfile, outputs))
+    job.encodeseconds += time.perf_counter() - start
+
+
+def plugdefaults(alg, weights=None, stylescales=None, tileoverlap=None, algparams=None, sweep=False):
+    """Checks the algorithm and fills in default values for unspecified style transfer options
+
+    Returns the weights, stylescales, tileoverlap, algparams and sweep options to use.
+    """
     # Check arguments
     if alg not in ALGORITHMS.keys():
         raise ValueError("Unrecognized algorithm %s, must be one of %s" % (alg, str(list(ALGORITHMS.keys()))))
@@ -76,23 +281,92 @@ def styletransfer(contents, styles, savefolder, size=None, alg="gatys", weights=
         tileoverlap = 100
     if algparams is None:
         algparams = []
+    if sweep and alg != "gatys":
+        LOGGER.warning("Warm started sweeps are only available for the gatys algorithm. Running all combinations "
+                       "from scratch")
+        sweep = False
+    return weights, stylescales, tileoverlap, algparams, sweep
 
-    # Iterate through all combinations
-    for content, style, weight, scale in product(contents, styles, weights, stylescales):
-        outfile = outname(savefolder, content, style, alg, scale, weight)
-        # If the desired size is smaller than the maximum tile size, use a direct neural style
-        if fitsingletile(targetshape(content, size), alg):
-            styletransfer_single(content=content, style=style, outfile=outfile, size=size, alg=alg, weight=weight,
-                                 stylescale=scale, algparams=algparams)
-        # Else use a tiling strategy
-        else:
-            neuraltile(content=content, style=style, outfile=outfile, size=size, overlap=tileoverlap, alg=alg,
-                       weight=weight, stylescale=scale, algparams=algparams)
 
+def jobgrid(contents, styles, savefolder, alg, weights, stylescales, sweep=False):
+    """Lists the style transfer jobs for all combinations of options, in execution order
+
+    Each job is described by a dictionary with its content, style, weight, stylescale and outfile, and the
+    initimage from which to warm start it: the outfile of the previous job in a sweep, or None.
+    """
+    grid = []
+    for content, style in product(contents, styles):
+        initimage = None
+        variants = sweeporder(weights, stylescales) if sweep else product(weights, stylescales)
+        for weight, scale in variants:
+            outfile = outname(savefolder, content, style, alg, scale, weight)
+            grid.append({"content": content, "style": style, "weight": weight, "stylescale": scale,
+                         "outfile": outfile, "initimage": initimage})
+            if sweep:
+                initimage = outfile
+    return grid
 
-def styletransfer_single(content, style, outfile, size=None, alg="gatys", weight=5.0, stylescale=1.0, algparams=None):
-    """General style transfer routine over a single set of options"""
+
+def planorder(grid, plan):
+    """Reorders a list of jobs to follow the order of the jobs in a plan
+
+    Jobs not present in the plan are run afterwards, in their original order.
+    """
+    position = {job["outfile"]: i for i, job in enumerate(plan["jobs"])}
+    return sorted(grid, key=lambda job: position.get(job["outfile"], len(position)))
+
+
+def styletransfer_fit(content, style, outfile, size=None, alg="gatys", weight=5.0, stylescale=1.0, algparams=None,
+                      overlap=100, adaptiveoverlap=False, initimage=None, sharedir=None, iterbudget=None,
+                      checkpointdir=None):
+    """Style transfer routine over a single set of options, using a tiling strategy if the image is too large
+
+    If a sharedir is given, tiles are processed by distributed workers. If an iterbudget is given, iterations are
+    distributed among tiles according to their detail. If a checkpointdir is given, progress is saved there.
+
+    If the algorithm runs out of GPU memory, a smaller maximum tile size is learned for the algorithm and the image
+    is retried, now split into smaller tiles, waiting a bit before each retry in case the GPU is shared.
+    """
+    imshape = targetshape(content, size)
+    for attempt in range(OOM_RETRIES + 1):
+        try:
+            # If the desired size is smaller than the maximum tile size, use a direct neural style
+            if fitsingletile(imshape, alg):
+                styletransfer_single(content=content, style=style, outfile=outfile, size=size, alg=alg,
+                                     weight=weight, stylescale=stylescale, algparams=algparams, initimage=initimage,
+                                     checkpointdir=checkpointdir)
+            # Else use a tiling strategy
+            else:
+                neuraltile(content=content, style=style, outfile=outfile, size=size, overlap=overlap, alg=alg,
+                           weight=weight, stylescale=stylescale, algparams=algparams,
+                           adaptiveoverlap=adaptiveoverlap, initimage=initimage, sharedir=sharedir,
+                           iterbudget=iterbudget, checkpointdir=checkpointdir)
+            return
+        except OutOfMemoryError:
+            if attempt == OOM_RETRIES:
+                raise
+            limit = int(min(maxtile(alg), np.sqrt(np.prod(imshape))) * OOM_SHRINK)
+            if limit <= overlap:
+                raise
+            learntilelimit(alg, limit)
+            backoff = min(OOM_BACKOFF * 2 ** attempt, OOM_MAXBACKOFF)
+            LOGGER.warning("Out of GPU memory processing %s with shape %s, retrying in %d seconds with a maximum "
+                           "tile size of %d" % (content, str(imshape), backoff, limit))
+            metrics.record(oomretries=1)
+            time.sleep(backoff)
+
+
+def styletransfer_single(content, style, outfile, size=None, alg="gatys", weight=5.0, stylescale=1.0, algparams=None,
+                         initimage=None, checkpointdir=None):
+    """General style transfer routine over a single set of options
+
+    An initimage can be provided to warm start the gatys algorithm, which then runs for fewer iterations. If a
+    checkpointdir is provided, the steps of gatys-multiresolution are saved there to allow resuming.
+    """
+    if algparams is None:
+        algparams = []
     workdir = TemporaryDirectory()
+    metrics.registerworkdir(workdir.name)
 
     # Cut out alpha channel from content
     rgbfile = workdir.name + "/" + "rgb.png"
@@ -106,11 +380,19 @@ def styletransfer_single(content, style, outfile, size=None, alg="gatys", weight
     # Call style transfer algorithm
     algfile = workdir.name + "/" + "algoutput.png"
     if alg == "gatys":
+        if initimage is not None:
+            algparams = warmstartparams(algparams, initimage)
         gatys(rgbfile, stylepng, algfile, size, weight, stylescale, algparams)
     elif alg == "gatys-multiresolution":
-        gatys_multiresolution(rgbfile, stylepng, algfile, size, weight, stylescale, algparams)
+        gatys_multiresolution(rgbfile, stylepng, algfile, size, weight, stylescale, algparams,
+                              checkpointdir=checkpointdir)
     elif alg in ["chen-schmidt", "chen-schmidt-inverse"]:
         chenschmidt(alg, rgbfile, stylepng, algfile, size, stylescale, algparams)
+    restorealpha(algfile, alphafile, content, size, outfile)
+
+
+def restorealpha(algfile, alphafile, content, size, outfile):
+    """Brings the output of a style transfer algorithm to the shape of the content, and recovers its alpha channel"""
     # Enforce correct size
     correctshape(algfile, content, size)
 
@@ -120,13 +402,141 @@ def styletransfer_single(content, style, outfile, size=None, alg="gatys", weight
 
 
 def neuraltile(content, style, outfile, size=None, overlap=100, alg="gatys", weight=5.0, stylescale=1.0,
-               algparams=None):
-    """Strategy to generate a high resolution image by running style transfer on overlapping image tiles"""
+               algparams=None, adaptiveoverlap=False, initimage=None, sharedir=None, iterbudget=None,
+               checkpointdir=None):
+    """Strategy to generate a high resolution image by running style transfer on overlapping image tiles
+
+    By default all tiles overlap by the same amount of pixels, and are blended through feathering. If adaptiveoverlap
+    is True, the overlap of each edge is chosen from the content around it, up to the given overlap, and tiles are
+    blended by cutting a minimum error seam through each overlap.
+
+    If an initimage is provided, it is chopped with the same tile layout to warm start each tile.
+
+    If a sharedir is provided, tiles are published as tasks in that folder, and blended once all of them have been
+    processed by distributed workers.
+
+    If an iterbudget is provided, the gatys algorithm runs more iterations on detailed tiles and fewer on flat ones,
+    for a total of iterbudget times the iterations of a uniform allocation.
+
+    If a checkpointdir is provided, the tile layout and each finished tile are saved in a workspace inside it, and
+    running again the same job continues from the first unfinished tile.
+    """
     LOGGER.info("Starting tiling strategy")
     if algparams is None:
         algparams = []
-    workdir = TemporaryDirectory()
+    if checkpointdir is not None:
+        workdir = tileworkspace(checkpointdir, content, style, size, overlap, alg, weight, stylescale, algparams,
+                                adaptiveoverlap, initimage, iterbudget)
+    else:
+        workdir = TemporaryDirectory()
+    metrics.registerworkdir(workdir.name)
+
+    # Scale image to target resolution and chop it into tiles, or recover the layout of a previous run
+    layout = None
+    if checkpointdir is not None:
+        layout = checkpoints.loadstate(workdir.name, "layout")
+    if layout is not None:
+        layout["tiles"] = [join(workdir.name, tile) for tile in layout["tiles"]]
+        metrics.record(tiles=len(layout["tiles"]))
+    else:
+        layout = tilelayout(content, size, overlap, alg, adaptiveoverlap, workdir.name)
+        if checkpointdir is not None:
+            checkpoints.savestate(workdir.name, "layout", dict(layout, tiles=[basename(t) for t in layout["tiles"]]))
+
+    # Chop the warm start image with the same layout
+    seedtiles = [None] * len(layout["tiles"])
+    if initimage is not None:
+        seedpass = workdir.name + "/" + "seed.png"
+        convert(initimage, seedpass)
+        resize(seedpass, layout["shape"])
+        seedtiles = chop(seedpass, workdir.name + "/" + "seed_tiles", layout)
+
+    # Iterations for each tile
+    tileparams = [algparams] * len(layout["tiles"])
+    if iterbudget is not None:
+        if alg == "gatys":
+            scores = [tiledetail(readimage(tile)) for tile in layout["tiles"]]
+            iterations = allocateiterations(scores, numiterations(algparams), iterbudget)
+            LOGGER.info("Iterations per tile: %s" % str(iterations))
+            tileparams = [list(algparams) + ["-num_iterations", n] for n in iterations]
+        else:
+            LOGGER.warning("Iteration budgets are only available for the gatys algorithm. Ignoring budget")
+
+    # Tiles finished in a previous run are not processed again
+    highrestiles = [workdir.name + "/" + "highres_tiles_" + str(i) + ".png" for i in range(len(layout["tiles"]))]
+    pending = list(range(len(layout["tiles"])))
+    if checkpointdir is not None:
+        pending = [i for i in pending if checkpoints.finished(workdir.name, "highres_tiles_%d" % i) is None]
+        metrics.record(cachehits=len(layout["tiles"]) - len(pending))
+        if len(pending) < len(layout["tiles"]):
+            LOGGER.info("Resuming with %d of %d tiles already finished" % (len(layout["tiles"]) - len(pending),
+                                                                           len(layout["tiles"])))
+
+    # High resolution pass over each tile. If a tile runs out of memory, only that tile is tiled further.
+    if sharedir is not None and pending:
+        jobid = distributed.publish(sharedir, [layout["tiles"][i] for i in pending], [seedtiles[i] for i in pending],
+                                    style, {
+                                        "alg": alg, "weight": weight, "stylescale": stylescale, "overlap": overlap,
+                                        "adaptiveoverlap": adaptiveoverlap
+                                    }, [{"algparams": [str(p) for p in tileparams[i]]} for i in pending])
+        # Each tile is saved as soon as it arrives, so that an interruption keeps the tiles already processed
+        def tilefinished(index):
+            if checkpointdir is not None:
+                checkpoints.markfinished(workdir.name, "highres_tiles_%d" % pending[index],
+                                         highrestiles[pending[index]])
+        distributed.collect(sharedir, jobid, [highrestiles[i] for i in pending], onresult=tilefinished)
+    else:
+        for i in pending:
+            styletransfer_fit(layout["tiles"][i], style, highrestiles[i], size=None, alg=alg, weight=weight,
+                              stylescale=stylescale, algparams=tileparams[i], overlap=overlap,
+                              adaptiveoverlap=adaptiveoverlap, initimage=seedtiles[i], checkpointdir=checkpointdir)
+            if checkpointdir is not None:
+                checkpoints.markfinished(workdir.name, "highres_tiles_%d" % i, highrestiles[i])
+
+    blendtiles(highrestiles, layout, outfile, workdir.name)
+    if checkpointdir is not None:
+        workdir.cleanup()
+
+
+def tileworkspace(checkpointdir, content, style, size, overlap, alg, weight, stylescale, algparams, adaptiveoverlap,
+                  initimage, iterbudget):
+    """Opens the persistent workspace of a tiled job
+
+    The workspace is identified by the contents of the input images and all options affecting the result. The maximum
+    tile size is not part of it, as the saved layout is reused when resuming, and unfinished tiles that run out of
+    memory are split further.
+    """
+    return PersistentDirectory(checkpoints.workspace(checkpointdir, "neuraltile", {
+        "content": checkpoints.filedigest(content), "style": checkpoints.filedigest(style),
+        "initimage": checkpoints.filedigest(initimage), "size": size, "overlap": overlap, "alg": alg,
+        "weight": weight, "stylescale": stylescale, "algparams": [str(p) for p in algparams],
+        "adaptiveoverlap": adaptiveoverlap, "iterbudget": iterbudget
+    }))
+
+
+class PersistentDirectory:
+    """Work folder with the same interface as a TemporaryDirectory, but that is only removed when its work is done"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def cleanup(self):
+        checkpoints.complete(self.name)
 
+
+def tiletask(task, outfile):
+    """Processes a tile task published by neuraltile in distributed mode, saving the stylized tile in outfile"""
+    styletransfer_fit(task["tile"], task["style"], outfile, size=None, alg=task["alg"], weight=task["weight"],
+                      stylescale=task["stylescale"], algparams=task["algparams"], overlap=task["overlap"],
+                      adaptiveoverlap=task["adaptiveoverlap"], initimage=task["seed"])
+
+
+def tilelayout(content, size, overlap, alg, adaptiveoverlap, workdir):
+    """Scales a content image to its target resolution and chops it into tiles, saving them in a work folder
+
+    Returns a dictionary describing the tile layout: target shape, number of X and Y tiles, overlap, tile boxes and
+    edge overlaps (if adaptive overlaps are used, else None), and the list of tile files.
+    """
     # Gather size info from original image
     fullshape = targetshape(content, size)
 
@@ -134,42 +544,54 @@ def neuraltile(content, style, outfile, size=None, overlap=100, alg="gatys", wei
     xtiles, ytiles = tilegeometry(fullshape, alg, overlap)
 
     # First scale image to target resolution
-    firstpass = workdir.name + "/" + "lowres.png"
+    firstpass = workdir + "/" + "lowres.png"
     convert(content, firstpass)
     resize(firstpass, fullshape)
 
-    # Chop the styled image into tiles with the specified overlap value.
-    lowrestiles = choptiles(firstpass, xtiles=xtiles, ytiles=ytiles, overlap=overlap,
-                            outname=workdir.name + "/" + "lowres_tiles")
+    # Chop the styled image into tiles with the specified overlap value, or with content adaptive overlaps
+    layout = {"shape": fullshape, "xtiles": xtiles, "ytiles": ytiles, "overlap": overlap, "boxes": None,
+              "overlaps": None}
+    if adaptiveoverlap:
+        layout["boxes"], layout["overlaps"] = adaptivetiles(readimage(firstpass), xtiles, ytiles, overlap)
+    layout["tiles"] = chop(firstpass, workdir + "/" + "lowres_tiles", layout)
+    metrics.record(tiles=len(layout["tiles"]))
+    return layout
 
-    # High resolution pass over each tile
-    highrestiles = []
-    for i, tile in enumerate(lowrestiles):
-        name = workdir.name + "/" + "highres_tiles_" + str(i) + ".png"
-        styletransfer_single(tile, style, name, size=None, alg=alg, weight=weight, stylescale=stylescale,
-                             algparams=algparams)
-        highrestiles.append(name)
 
-    # Feather tiles
-    featheredtiles = []
-    for i, tile in enumerate(highrestiles):
-        name = workdir.name + "/" + "feathered_tiles_" + str(i) + ".png"
-        feather(tile, name)
-        featheredtiles.append(name)
+def blendtiles(highrestiles, layout, outfile, workdir):
+    """Blends the stylized tiles of a tile layout into the final image"""
+    xtiles, ytiles, overlap = layout["xtiles"], layout["ytiles"], layout["overlap"]
+    if layout["boxes"] is not None:
+        # Blend tiles along minimum error seams
+        tiles = [readimage(tile) for tile in highrestiles]
+        writeimage(quilt(tiles, layout["boxes"], layout["overlaps"], layout["shape"]), outfile)
+    else:
+        # Feather tiles
+        featheredtiles = []
+        for i, tile in enumerate(highrestiles):
+            name = workdir + "/" + "feathered_tiles_" + str(i) + ".png"
+            feather(tile, name)
+            featheredtiles.append(name)
 
-    # Smush the feathered tiles together
-    smushedfeathered = workdir.name + "/" + "feathered_smushed.png"
-    smush(featheredtiles, xtiles, ytiles, overlap, overlap, smushedfeathered)
+        # Smush the feathered tiles together
+        smushedfeathered = workdir + "/" + "feathered_smushed.png"
+        smush(featheredtiles, xtiles, ytiles, overlap, overlap, smushedfeathered)
 
-    # Smush also the non-feathered tiles
-    smushedhighres = workdir.name + "/" + "highres_smushed.png"
-    smush(highrestiles, xtiles, ytiles, overlap, overlap, smushedhighres)
+        # Smush also the non-feathered tiles
+        smushedhighres = workdir + "/" + "highres_smushed.png"
+        smush(highrestiles, xtiles, ytiles, overlap, overlap, smushedhighres)
 
-    # Combine feathered and un-feathered output images to disguise feathering
-    composite([smushedfeathered, smushedhighres], outfile)
+        # Combine feathered and un-feathered output images to disguise feathering, adjusting back to desired size
+        composite([smushedfeathered, smushedhighres], outfile, layout["shape"])
+    metrics.sampledisk()
 
-    # Adjust back to desired size
-    assertshape(outfile, fullshape)
+
+def chop(imfile, outname, layout):
+    """Chops an image into tiles following a tile layout, either with uniform overlaps or with the layout boxes"""
+    if layout["boxes"] is not None:
+        return croptiles(imfile, layout["boxes"], outname=outname)
+    return choptiles(imfile, xtiles=layout["xtiles"], ytiles=layout["ytiles"], overlap=layout["overlap"],
+                     outname=outname)
 
 
 def gatys(content, style, outfile, size, weight, stylescale, algparams):
@@ -195,7 +617,8 @@ def gatys(content, style, outfile, size, weight, stylescale, algparams):
     tmpout.close()
 
 
-def gatys_multiresolution(content, style, outfile, size, weight, stylescale, algparams, startres=256):
+def gatys_multiresolution(content, style, outfile, size, weight, stylescale, algparams, startres=256,
+                          checkpointdir=None):
     """Runs a multiresolution version of Gatys et al method
 
     The multiresolution strategy starts by generating a small image, then using that image as initializer
@@ -207,55 +630,89 @@ def gatys_multiresolution(content, style, outfile, size, weight, stylescale, alg
     References:
         * Gatys et al - Controlling Perceptual Factors in Neural Style Transfer (https://arxiv.org/abs/1611.07865)
         * https://gist.github.com/jcjohnson/ca1f29057a187bc7721a3a8c418cc7db
+
+    If a checkpointdir is provided, the seed produced by each step is saved in a workspace inside it, and running
+    again the same job continues from the first unfinished step.
     """
-    # Multiresolution strategy: list of rounds, each round composed of a optimization method and a number of
-    # upresolution steps.
-    # Using "adam" as optimizer means that Adam will be used when necessary to attain higher resolutions
-    strategy = [
-        ["lbfgs", 7],
-        ["lbfgs", 7],
-        ["lbfgs", 7],
-        ["lbfgs", 7],
-        ["lbfgs", 7]
-    ]
-    LOGGER.info("Starting gatys-multiresolution with strategy " + str(strategy))
+    LOGGER.info("Starting gatys-multiresolution with strategy " + str(MULTIRESOLUTION_STRATEGY))
 
     # Initialization
-    workdir = TemporaryDirectory()
-    maxres = targetshape(content, size)[0]
-    if maxres < startres:
-        LOGGER.warning("Target resolution (%d) might too small for the multiresolution method to work well" % maxres)
-        startres = maxres / 2.0
+    if checkpointdir is not None:
+        workdir = PersistentDirectory(checkpoints.workspace(checkpointdir, "gatys-multiresolution", {
+            "content": checkpoints.filedigest(content), "style": checkpoints.filedigest(style), "size": size,
+            "weight": weight, "stylescale": stylescale, "algparams": [str(p) for p in algparams],
+            "startres": startres, "strategy": MULTIRESOLUTION_STRATEGY
+        }))
+    else:
+        workdir = TemporaryDirectory()
+    metrics.registerworkdir(workdir.name)
     seed = None
     tmpout = workdir.name + "/tmpout.png"
 
-    # Iterate over rounds
-    for roundnumber, (optimizer, steps) in enumerate(strategy):
-        LOGGER.info("gatys-multiresolution round %d with %s optimizer and %d steps" % (roundnumber, optimizer, steps))
+    # Recover the seed of the last step finished in a previous run
+    laststep = -1
+    if checkpointdir is not None:
+        finishedseed = checkpoints.finished(workdir.name, "seed")
+        if finishedseed is not None:
+            seed, laststep = finishedseed["file"], finishedseed["step"]
+            LOGGER.info("Resuming from step %d" % (laststep + 2))
+            metrics.record(cachehits=laststep + 1)
+
+    # Iterate over rounds and steps, keeping those planned in a previous run, as they depend on the maximum tile size
+    steps = None
+    if checkpointdir is not None:
+        steps = checkpoints.loadstate(workdir.name, "steps")
+    if steps is None:
+        steps = multiresolutionsteps(targetshape(content, size)[0], startres)
+        if checkpointdir is not None:
+            checkpoints.savestate(workdir.name, "steps", steps)
+    for i, (roundnumber, stepnumber, res, stepopt, iters) in enumerate(steps):
+        if i <= laststep:
+            continue
+        LOGGER.info("Round %d, step %d, resolution %d, optimizer %s" % (roundnumber, stepnumber, res, stepopt))
+        passparams = algparams[:]
+        passparams.extend([
+            "-num_iterations", iters,
+            "-tv_weight", "0",
+            "-print_iter", "0",
+            "-optimizer", stepopt
+        ])
+        if seed is not None:
+            passparams.extend([
+                "-init", "image",
+                "-init_image", seed
+            ])
+        gatys(content, style, tmpout, res, weight, stylescale, passparams)
+        seed = workdir.name + "/seed.png"
+        if checkpointdir is not None:
+            checkpoints.markfinished(workdir.name, "seed", tmpout, step=i)
+        else:
+            copyfile(tmpout, seed)
+        metrics.record(multiresolutionsteps=1)
+
+    convert(seed, outfile)
+    if checkpointdir is not None:
+        workdir.cleanup()
+
+
+def multiresolutionsteps(maxres, startres=256):
+    """Lists the passes run by the gatys-multiresolution strategy to attain a given resolution
+
+    Returns a list of (round, step, resolution, optimizer, iterations) tuples.
+    """
+    if maxres < startres:
+        LOGGER.warning("Target resolution (%d) might too small for the multiresolution method to work well" % maxres)
+        startres = maxres / 2.0
+    passes = []
+    for roundnumber, (optimizer, steps) in enumerate(MULTIRESOLUTION_STRATEGY):
         roundmax = min(maxtile("gatys"), maxres) if optimizer == "lbfgs" else maxres
         resolutions = np.linspace(startres, roundmax, steps, dtype=int)
         iters = 1000
         for stepnumber, res in enumerate(resolutions):
             stepopt = "adam" if res > maxtile("gatys") else "lbfgs"
-            LOGGER.info("Step %d, resolution %d, optimizer %s" % (stepnumber, res, stepopt))
-            passparams = algparams[:]
-            passparams.extend([
-                "-num_iterations", iters,
-                "-tv_weight", "0",
-                "-print_iter", "0",
-                "-optimizer", stepopt
-            ])
-            if seed is not None:
-                passparams.extend([
-                    "-init", "image",
-                    "-init_image", seed
-                ])
-            gatys(content, style, tmpout, res, weight, stylescale, passparams)
-            seed = workdir.name + "/seed.png"
-            copyfile(tmpout, seed)
+            passes.append((roundnumber, stepnumber, int(res), stepopt, iters))
             iters = max(iters/2.0, 100)
-
-    convert(tmpout, outfile)
+    return passes
 
 
 def chenschmidt(alg, content, style, outfile, size, stylescale, algparams):
@@ -274,6 +731,7 @@ def chenschmidt(alg, content, style, outfile, size, stylescale, algparams):
     resize(instyle.name, int(stylescale * shape(style)[0]))
     # Run algorithm
     outdir = TemporaryDirectory()
+    metrics.registerworkdir(outdir.name)
     runalgorithm(alg, [
         "--save", outdir.name,
         "--content", content,
@@ -283,21 +741,211 @@ def chenschmidt(alg, content, style, outfile, size, stylescale, algparams):
         *algparams
     ])
     # Gather output results
-    output = outdir.name + "/" + filename(content) + "_stylized" + fileext(content)
-    convert(output, outfile)
+    convert(stylizedname(outdir.name, content), outfile)
     instyle.close()
 
 
+def chenschmidt_batch(alg, contents, style, outfiles, stylescale, algparams):
+    """Runs Chen and Schmidt algorithm over several content images with the same style in a single invocation
+
+    This avoids reloading the networks for each content image. As the algorithm only accepts a single maximum size,
+    the largest content image determines the maximum content and style sizes of the whole batch.
+    """
+    if alg not in ["chen-schmidt", "chen-schmidt-inverse"]:
+        raise ValueError("Unnaceptable subalgorithm %s for Chen-Schmidt family" % alg)
+    workdir = TemporaryDirectory()
+    metrics.registerworkdir(workdir.name)
+
+    # Rescale style as requested
+    instyle = workdir.name + "/style.png"
+    convert(style, instyle)
+    resize(instyle, int(stylescale * shape(style)[0]))
+    # Gather contents in a folder, with unique names
+    contentdir = workdir.name + "/contents"
+    mkdir(contentdir)
+    batchcontents = []
+    for i, content in enumerate(contents):
+        batchcontents.append(contentdir + "/content_%d.png" % i)
+        convert(content, batchcontents[-1])
+    maxsize = max(shape(content)[0] for content in contents)
+    # Run algorithm
+    outdir = workdir.name + "/output"
+    mkdir(outdir)
+    runalgorithm(alg, [
+        "--save", outdir,
+        "--contentBatch", contentdir,
+        "--style", instyle,
+        "--maxContentSize", maxsize,
+        "--maxStyleSize", maxsize,
+        *algparams
+    ])
+    # Map output results back to their requested files
+    for batchcontent, outfile in zip(batchcontents, outfiles):
+        convert(stylizedname(outdir, batchcontent), outfile)
+
+
+def chenschmidt_grid(grid, size, alg, tileoverlap, algparams, adaptiveoverlap=False):
+    """Runs a list of Chen-Schmidt jobs, stylizing together all images and tiles sharing the same style, scale and width
+
+    Jobs are given as produced by jobgrid. Each job is split into units (the full image, or each of its tiles), and
+    all units with the same style, scale and width are stylized in a single invocation of the algorithm, so that
+    each unit is stylized with the same maximum sizes as if run on its own. Results are then
+    mapped back to their jobs and tile slots, and tiled jobs are blended.
+
+    Returns the list of JobMetrics of the jobs. The cost of each invocation is split among the jobs it served in
+    proportion to the number of pixels of their units.
+    """
+    workdir = TemporaryDirectory()
+    jobs = []
+    layouts = []
+    units = []
+    for index, spec in enumerate(grid):
+        job = metrics.JobMetrics(spec["outfile"], spec["content"], spec["style"], alg, spec["weight"],
+                                 spec["stylescale"])
+        jobs.append(job)
+        jobdir = workdir.name + "/job_" + str(index)
+        mkdir(jobdir)
+        with metrics.trackjob(job):
+            metrics.registerworkdir(jobdir)
+            if fitsingletile(targetshape(spec["content"], size), alg):
+                layouts.append(None)
+                units.append(batchunit(index, spec, spec["content"], size, spec["outfile"], jobdir + "/single"))
+            else:
+                layout = tilelayout(spec["content"], size, tileoverlap, alg, adaptiveoverlap, jobdir)
+                layouts.append(layout)
+                for i, tile in enumerate(layout["tiles"]):
+                    name = jobdir + "/" + "highres_tiles_" + str(i) + ".png"
+                    units.append(batchunit(index, spec, tile, None, name, jobdir + "/tile_" + str(i)))
+
+    # Run one batch per style, scale and width
+    for (style, stylescale, width), members in batchgroups(units).items():
+        LOGGER.info("Running %s batch of %d images of width %d for style %s, scale %s" %
+                    (alg, len(members), width, style, stylescale))
+        batchjob = metrics.JobMetrics(None, None, style, alg, stylescale=stylescale)
+        try:
+            with metrics.trackjob(batchjob):
+                chenschmidt_batch(alg, [unit["rgbfile"] for unit in members], style,
+                                  [unit["algfile"] for unit in members], stylescale, algparams)
+        except OutOfMemoryError:
+            LOGGER.warning("Out of GPU memory running batch, falling back to one invocation per image")
+            for unit in members:
+                with metrics.trackjob(jobs[unit["job"]]):
+                    styletransfer_fit(unit["content"], style, unit["outfile"], size=unit["size"], alg=alg,
+                                      weight=None, stylescale=stylescale, algparams=algparams, overlap=tileoverlap,
+                                      adaptiveoverlap=adaptiveoverlap)
+                unit["done"] = True
+        metrics.split(batchjob, [jobs[unit["job"]] for unit in members], [unit["pixels"] for unit in members])
+
+    # Recover alpha channels, and blend tiles
+    for unit in units:
+        if unit["done"]:
+            continue
+        with metrics.trackjob(jobs[unit["job"]]):
+            restorealpha(unit["algfile"], unit["alphafile"], unit["content"], unit["size"], unit["outfile"])
+    for index, (spec, layout) in enumerate(zip(grid, layouts)):
+        if layout is not None:
+            with metrics.trackjob(jobs[index]):
+                highrestiles = [unit["outfile"] for unit in units if unit["job"] == index]
+                blendtiles(highrestiles, layout, spec["outfile"], workdir.name + "/job_" + str(index))
+    return jobs
+
+
+def batchunit(job, spec, content, size, outfile, prefix):
+    """Prepares an image to be stylized as part of a batch, splitting its alpha channel and scaling it to target size
+
+    Returns a dictionary describing the unit: the index of the job it belongs to, its style and scale, the content
+    image and target size, the RGB and alpha files, the file where the algorithm output will be saved, the final
+    output file, its width and number of pixels, and whether it has already been fully processed.
+    """
+    rgbfile = prefix + "_rgb.png"
+    alphafile = prefix + "_alpha.png"
+    extractalpha(content, rgbfile, alphafile)
+    correctshape(rgbfile, content, size)
+    contentshape = shape(rgbfile)
+    return {"job": job, "style": spec["style"], "stylescale": spec["stylescale"], "content": content, "size": size,
+            "rgbfile": rgbfile, "alphafile": alphafile, "algfile": prefix + "_algoutput.png", "outfile": outfile,
+            "width": contentshape[0], "pixels": contentshape[0] * contentshape[1], "done": False}
+
+
+def batchgroups(units):
+    """Groups batch units by style, style scale and width, keeping their order. Returns a dictionary of lists of units
+
+    As Chen-Schmidt only accepts a single maximum size per invocation, grouping by width ensures every unit is
+    stylized at its own size.
+    """
+    groups = OrderedDict()
+    for unit in units:
+        groups.setdefault((unit["style"], unit["stylescale"], unit["width"]), []).append(unit)
+    return groups
+
+
+def stylizedname(outdir, content):
+    """Returns the name of the file in which Chen-Schmidt saves the stylization of a content image"""
+    return outdir + "/" + filename(content) + "_stylized" + fileext(content)
+
+
+def numiterations(algparams):
+    """Returns the number of iterations Gatys will run with the given parameters, or with the defaults if not present"""
+    params = [str(p) for p in ALGORITHMS["gatys"]["defaultpars"] + list(algparams)]
+    # Last value given takes precedence
+    position = max(i for i, p in enumerate(params) if p == "-num_iterations")
+    return int(float(params[position + 1]))
+
+
+def warmstartparams(algparams, initimage):
+    """Extends Gatys parameters to warm start the optimization from an image, with a reduced number of iterations"""
+    return list(algparams) + [
+        "-init", "image",
+        "-init_image", initimage,
+        "-num_iterations", max(SWEEP_MINITERS, int(numiterations(algparams) * SWEEP_ITERFRACTION))
+    ]
+
+
+def sweeporder(weights, stylescales):
+    """Orders all combinations of style weights and scales so that consecutive combinations are neighbours
+
+    Scales are visited in increasing order, and for each scale weights are visited in alternating increasing and
+    decreasing order, so that each combination differs from the previous one in a single parameter step.
+    """
+    ordered = sorted(weights)
+    combinations = []
+    for i, scale in enumerate(sorted(stylescales)):
+        combinations.extend((weight, scale) for weight in (ordered if i % 2 == 0 else ordered[::-1]))
+    return combinations
+
+
 def runalgorithm(alg, params):
-    """Run a style transfer algorithm with given parameters"""
+    """Run a style transfer algorithm with given parameters
+
+    Raises OutOfMemoryError if the algorithm runs out of GPU memory, or AlgorithmError if it fails for other reasons.
+    """
     # Move to algorithm folder
     command = "cd " + ALGORITHMS[alg]["folder"] + "; "
     # Algorithm command with default parameters
     command += ALGORITHMS[alg]["command"] + " " + " ".join(ALGORITHMS[alg]["defaultpars"])
     # Add provided parameters, if any
     command += " " + " ".join([str(p) for p in params])
+    # Gatys can run without GPUs, though very slowly
+    if alg == "gatys" and gpuname() == CPUNAME:
+        command += " -gpu -1"
     LOGGER.info("Running command: %s" % command)
-    call(command, shell=True)
+    start = time.perf_counter()
+    result = run(command, shell=True, stderr=PIPE)
+    metrics.record(gpuseconds=time.perf_counter() - start, algorithmruns=1)
+    metrics.sampledisk()
+    # Check for errors
+    errors = result.stderr.decode("utf-8", errors="replace")
+    sys.stderr.write(errors)
+    if result.returncode != 0:
+        if isoutofmemory(errors):
+            raise OutOfMemoryError("Algorithm %s ran out of GPU memory" % alg)
+        raise AlgorithmError("Algorithm %s failed with exit code %d: %s" % (alg, result.returncode,
+                                                                           errors.strip()[-1000:]))
+
+
+def isoutofmemory(errors):
+    """Returns whether the error output of a style transfer algorithm reveals an out of GPU memory error"""
+    return any(pattern.lower() in errors.lower() for pattern in OOM_PATTERNS)
 
 
 def outname(savefolder, content, style, alg, scale, weight=None, ext=None):
@@ -349,18 +997,6 @@ def targetshape(content, size=None):
         return [size, int(size * contentshape[1] / contentshape[0])]
 
 
-def gpuname():
-    """Returns the model name of the first available GPU"""
-    try:
-        gpus = GPUtil.getGPUs()
-    except:
-        LOGGER.warning("Unable to detect GPU model. Is your GPU configured? Are you running with nvidia-docker?")
-        return "UNKNOWN"
-    if len(gpus) == 0:
-        raise ValueError("No GPUs detected in the system")
-    return gpus[0].name
-
-
 def maxtile(alg="gatys"):
     """Returns the recommended configuration maximum tile size, based on the available GPU and algorithm to be run
 
@@ -368,7 +1004,34 @@ def maxtile(alg="gatys"):
     a maximum tile of the same number of pixels should be used.
     """
     gname = gpuname()
-    if gname not in GPUCONFIG:
+    learned = tilelimits().get(gname, {}).get(alg)
+    config = gpuconfig()
+    if gname not in config:
         LOGGER.warning(f"Unknown GPU model {gname}, will use default tiling parameters")
         gname = "default"
-    return GPUCONFIG[gname][alg]
+    if learned is not None:
+        return min(config[gname][alg], learned)
+    return config[gname][alg]
+
+
+def tilelimits():
+    """Returns the maximum tile sizes learned after running out of GPU memory, by GPU model and algorithm"""
+    global TILELIMITS
+    if TILELIMITS is None:
+        TILELIMITS = {}
+        if isfile(TILELIMITS_FILE):
+            with open(TILELIMITS_FILE, "r") as f:
+                TILELIMITS = json.load(f)
+    return TILELIMITS
+
+
+def learntilelimit(alg, limit):
+    """Records a maximum tile size for an algorithm in the current GPU, so that later jobs start with a working size"""
+    limits = tilelimits().setdefault(gpuname(), {})
+    limits[alg] = min(limit, limits.get(alg, limit))
+    try:
+        os.makedirs(dirname(TILELIMITS_FILE), exist_ok=True)
+        with open(TILELIMITS_FILE, "w") as f:
+            json.dump(TILELIMITS, f, indent=2)
+    except OSError:
+        LOGGER.warning("Unable to save learned tile limits to %s" % TILELIMITS_FILE)
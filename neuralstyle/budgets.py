@@ -0,0 +1,53 @@
+# Content adaptive allocation of optimization iterations among tiles
+import numpy as np
+from neuralstyle.seams import detailmap
+
+# Gradient magnitude above which a pixel is considered an edge, for 8-bit images
+EDGETHRESHOLD = 16.0
+# Minimum and maximum iterations for a tile, as fractions of the iterations of a uniform allocation
+MINITERFRACTION = 0.25
+MAXITERFRACTION = 1.25
+
+
+def tiledetail(pixels):
+    """Scores the amount of detail in an image, as the mean of its edge density and its normalized entropy
+
+    The score ranges from 0 (flat image) to 1.
+    """
+    edgedensity = (detailmap(pixels) > EDGETHRESHOLD).mean()
+    gray = pixels[..., :3].astype(float).mean(axis=2).astype(np.uint8)
+    histogram = np.bincount(gray.ravel(), minlength=256) / float(gray.size)
+    histogram = histogram[histogram > 0]
+    entropy = -(histogram * np.log2(histogram)).sum() / 8.0
+    return 0.5 * edgedensity + 0.5 * entropy
+
+
+def allocateiterations(scores, iterations, budget):
+    """Distributes a total budget of iterations among tiles in proportion to their detail scores
+
+    The total budget is the given fraction of a uniform allocation of the given iterations to each tile. No tile
+    gets fewer than MINITERFRACTION or more than MAXITERFRACTION times the uniform iterations; the iterations left
+    over by tiles hitting the maximum are redistributed among the rest.
+
+    Returns the list of iterations for each tile.
+    """
+    scores = np.maximum(np.asarray(scores, dtype=float), 1e-6)
+    low, high = MINITERFRACTION * iterations, MAXITERFRACTION * iterations
+    total = float(np.clip(budget * iterations * len(scores), low * len(scores), high * len(scores)))
+    # Every tile gets the minimum, the rest is shared proportionally, capping tiles at the maximum and
+    # redistributing what they leave among the rest
+    allocation = np.full(len(scores), low)
+    free = np.ones(len(scores), dtype=bool)
+    while free.any():
+        remaining = total - allocation.sum()
+        allocation[free] += remaining * scores[free] / scores[free].sum()
+        capped = free & (allocation >= high)
+        if not capped.any():
+            break
+        allocation[capped] = high
+        free &= ~capped
+    # Round so that the total is kept, giving the leftover iterations to the largest remainders
+    rounded = np.floor(allocation).astype(int)
+    leftover = int(round(total)) - rounded.sum()
+    rounded[np.argsort(rounded - allocation)[:leftover]] += 1
+    return [int(n) for n in rounded]
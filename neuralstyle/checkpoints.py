@@ -0,0 +1,159 @@
+# Persistent workspaces that allow resuming interrupted style transfer jobs
+#
+# Each workspace is a folder inside a checkpoints folder, named after a digest of the parameters of the work it
+# holds, so that rerunning the same work finds the same workspace. The manifest.json file inside the workspace
+# records these parameters, any state needed to resume (such as a tile layout), and the finished units of work, each
+# one with the file holding its result. Workspaces are removed once their work is complete.
+#
+# Whole jobs that were completed are also recorded in the checkpoints folder, as KIND_DIGEST.complete.json files with
+# the digest of their result file, so that rerunning a batch of jobs skips those already done. These records are
+# removed after CHECKPOINT_MAXAGE seconds.
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from os.path import isdir, isfile, join
+from neuralstyle.utils import fileext
+
+LOGGER = logging.getLogger(__name__)
+
+# Seconds after which an abandoned workspace is removed
+CHECKPOINT_MAXAGE = 7 * 24 * 3600
+
+
+def filedigest(path):
+    """Returns a digest of the contents of a file, or None if no file is given"""
+    if path is None:
+        return None
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def workspace(checkpointdir, kind, params):
+    """Opens the workspace for a kind of work with the given parameters, creating it if it does not exist
+
+    The parameters must be JSON-serializable, and should identify the work completely: input files should be given
+    through their digests rather than their paths. Returns the path to the workspace folder.
+    """
+    folder = join(checkpointdir, workname(kind, params))
+    if isfile(join(folder, "manifest.json")):
+        LOGGER.info("Resuming %s from workspace %s" % (kind, folder))
+    else:
+        os.makedirs(folder, exist_ok=True)
+        savemanifest(folder, {"kind": kind, "params": params, "created": time.time(), "state": {}, "units": {}})
+    return folder
+
+
+def workname(kind, params):
+    """Returns the name identifying a kind of work with the given parameters inside a checkpoints folder"""
+    description = json.dumps({"kind": kind, "params": params}, sort_keys=True)
+    return kind + "_" + hashlib.sha1(description.encode("utf-8")).hexdigest()[:16]
+
+
+def loadmanifest(folder):
+    """Loads the manifest of a workspace"""
+    with open(join(folder, "manifest.json"), "r") as f:
+        return json.load(f)
+
+
+def savemanifest(folder, manifest):
+    """Saves the manifest of a workspace, atomically"""
+    tmpfile = join(folder, "manifest.json.tmp")
+    with open(tmpfile, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmpfile, join(folder, "manifest.json"))
+
+
+def loadstate(folder, key):
+    """Returns a value of the resume state of a workspace, or None if not recorded"""
+    return loadmanifest(folder)["state"].get(key)
+
+
+def savestate(folder, key, value):
+    """Records a value in the resume state of a workspace"""
+    manifest = loadmanifest(folder)
+    manifest["state"][key] = value
+    savemanifest(folder, manifest)
+
+
+def finished(folder, unit):
+    """Returns the record of a finished unit of work, with the absolute path of its result file, or None if the unit
+    has not been finished"""
+    record = loadmanifest(folder)["units"].get(unit)
+    if record is None or not isfile(join(folder, record["file"])):
+        return None
+    return dict(record, file=join(folder, record["file"]))
+
+
+def markfinished(folder, unit, resultfile, **info):
+    """Records a unit of work as finished, together with any additional info
+
+    The result file is copied into the workspace, unless it is already there.
+    """
+    name = unit + fileext(resultfile)
+    if os.path.abspath(resultfile) != os.path.abspath(join(folder, name)):
+        shutil.copyfile(resultfile, join(folder, name + ".tmp"))
+        os.replace(join(folder, name + ".tmp"), join(folder, name))
+    manifest = loadmanifest(folder)
+    manifest["units"][unit] = dict(info, file=name, finished=time.time())
+    savemanifest(folder, manifest)
+
+
+def complete(folder):
+    """Marks the work of a workspace as complete, removing the workspace"""
+    manifest = loadmanifest(folder)
+    manifest["complete"] = True
+    savemanifest(folder, manifest)
+    shutil.rmtree(folder, ignore_errors=True)
+
+
+def markjobcomplete(checkpointdir, kind, params, resultfile):
+    """Records a whole job as complete, together with the digest of its result file"""
+    os.makedirs(checkpointdir, exist_ok=True)
+    recordfile = join(checkpointdir, workname(kind, params) + ".complete.json")
+    with open(recordfile + ".tmp", "w") as f:
+        json.dump({"kind": kind, "params": params, "file": os.path.abspath(resultfile),
+                   "digest": filedigest(resultfile), "created": time.time()}, f, indent=2)
+    os.replace(recordfile + ".tmp", recordfile)
+
+
+def jobcomplete(checkpointdir, kind, params, resultfile):
+    """Returns whether a whole job was recorded as complete, and its result file is still unmodified"""
+    recordfile = join(checkpointdir, workname(kind, params) + ".complete.json")
+    try:
+        with open(recordfile, "r") as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return record["file"] == os.path.abspath(resultfile) and isfile(resultfile) and \
+        filedigest(resultfile) == record["digest"]
+
+
+def collectgarbage(checkpointdir, maxage=CHECKPOINT_MAXAGE):
+    """Removes the workspaces of complete work, those not updated in maxage seconds, and old records of complete jobs"""
+    if not isdir(checkpointdir):
+        return
+    for name in os.listdir(checkpointdir):
+        if name.endswith(".complete.json"):
+            recordfile = join(checkpointdir, name)
+            if time.time() - os.path.getmtime(recordfile) > maxage:
+                LOGGER.info("Removing record of complete job %s" % recordfile)
+                os.remove(recordfile)
+            continue
+        folder = join(checkpointdir, name)
+        manifestfile = join(folder, "manifest.json")
+        if not isfile(manifestfile):
+            continue
+        try:
+            with open(manifestfile, "r") as f:
+                iscomplete = json.load(f).get("complete", False)
+        except ValueError:
+            iscomplete = False
+        if iscomplete or time.time() - os.path.getmtime(manifestfile) > maxage:
+            LOGGER.info("Removing workspace %s" % folder)
+            shutil.rmtree(folder, ignore_errors=True)
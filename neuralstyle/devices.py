@@ -0,0 +1,128 @@
+# Inventory of the devices available for style transfer, and their tiling configuration
+#
+# GPUs are probed at most once per process, and the result is kept in a short-lived snapshot file so that
+# consecutive runs do not need to probe again. The inventory can be overridden through the NEURALSTYLE_DEVICES
+# environment variable or the override function, with either "cpu" to run without GPUs, or a comma-separated list of
+# simulated GPUs in the form "NAME:MEMORY_MB", e.g. "Tesla K80:11439,Tesla K80:11439".
+import json
+import logging
+import os
+import time
+from os.path import abspath, dirname, expanduser, isfile, join
+
+LOGGER = logging.getLogger(__name__)
+
+# File with the maximum tile sizes per GPU model and algorithm
+GPUCONFIG_FILE = os.environ.get("NEURALSTYLE_GPUCONFIG", join(dirname(dirname(abspath(__file__))), "gpuconfig.json"))
+# File where the probed devices are saved, and seconds during which they are considered valid
+SNAPSHOT_FILE = os.environ.get("NEURALSTYLE_DEVICESNAPSHOT", expanduser("~/.neuralstyle/devices.json"))
+SNAPSHOT_TTL = 600
+# Name reported for the device when running without GPUs, and for GPUs that could not be identified
+CPUNAME = "CPU"
+UNKNOWNNAME = "UNKNOWN"
+
+_DEVICES = None
+_GPUCONFIG = None
+
+
+def devices():
+    """Returns the list of available devices, each one a dictionary with its index, name and memory in MB
+
+    When running without GPUs a single CPU device is listed. If GPUs are present but cannot be identified, a
+    single device of unknown name is listed.
+    """
+    global _DEVICES
+    if _DEVICES is None:
+        spec = os.environ.get("NEURALSTYLE_DEVICES")
+        if spec:
+            _DEVICES = parsedevices(spec)
+        else:
+            _DEVICES = readsnapshot()
+            if _DEVICES is None:
+                _DEVICES = probe()
+    return _DEVICES
+
+
+def override(spec):
+    """Replaces the available devices by those described in a spec string, or restores probing if spec is None"""
+    global _DEVICES
+    _DEVICES = parsedevices(spec) if spec is not None else None
+
+
+def parsedevices(spec):
+    """Parses a spec string with the devices to use: "cpu" or a comma-separated list of NAME[:MEMORY_MB]"""
+    if spec.strip().lower() == "cpu":
+        return [{"index": None, "name": CPUNAME, "memory": None}]
+    parsed = []
+    for i, device in enumerate(spec.split(",")):
+        name, separator, memory = device.strip().rpartition(":")
+        if not separator:
+            name, memory = memory, None
+        parsed.append({"index": i, "name": name, "memory": float(memory) if memory else None})
+    return parsed
+
+
+def probe():
+    """Probes the GPUs in the system, saving the result in the snapshot file
+
+    Probes finding no GPUs are not saved, as they might come from a transient failure of the driver tools.
+    """
+    try:
+        import GPUtil
+        gpus = GPUtil.getGPUs()
+    except Exception:
+        LOGGER.warning("Unable to detect GPU model. Is your GPU configured? Are you running with nvidia-docker?")
+        return [{"index": 0, "name": UNKNOWNNAME, "memory": None}]
+    probed = [{"index": gpu.id, "name": gpu.name, "memory": gpu.memoryTotal} for gpu in gpus]
+    if probed:
+        writesnapshot(probed)
+    return probed
+
+
+def readsnapshot():
+    """Returns the devices saved in the snapshot file, or None if there is no valid snapshot
+
+    Snapshots without any device are not valid, so that a failed probe is retried.
+    """
+    if not isfile(SNAPSHOT_FILE):
+        return None
+    try:
+        with open(SNAPSHOT_FILE, "r") as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # The snapshot is only valid for a while, and for the same set of visible GPUs
+    if time.time() - snapshot.get("timestamp", 0) > SNAPSHOT_TTL or \
+            snapshot.get("visible") != os.environ.get("CUDA_VISIBLE_DEVICES") or not snapshot.get("devices"):
+        return None
+    return snapshot["devices"]
+
+
+def writesnapshot(probed):
+    """Saves a list of probed devices to the snapshot file"""
+    snapshot = {"timestamp": time.time(), "visible": os.environ.get("CUDA_VISIBLE_DEVICES"), "devices": probed}
+    try:
+        os.makedirs(dirname(SNAPSHOT_FILE), exist_ok=True)
+        tmpfile = SNAPSHOT_FILE + ".%d.tmp" % os.getpid()
+        with open(tmpfile, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmpfile, SNAPSHOT_FILE)
+    except OSError:
+        LOGGER.warning("Unable to save device snapshot to %s" % SNAPSHOT_FILE)
+
+
+def gpuname():
+    """Returns the model name of the first available device"""
+    available = devices()
+    if len(available) == 0:
+        raise ValueError("No GPUs detected in the system. Use NEURALSTYLE_DEVICES=cpu to run without GPUs")
+    return available[0]["name"]
+
+
+def gpuconfig():
+    """Returns the configuration of maximum tile sizes, by GPU model and algorithm"""
+    global _GPUCONFIG
+    if _GPUCONFIG is None:
+        with open(GPUCONFIG_FILE, "r") as f:
+            _GPUCONFIG = json.load(f)
+    return _GPUCONFIG
@@ -0,0 +1,283 @@
+# Distribution of tiles among worker processes through a shared work folder
+#
+# The coordinator publishes each tile of a job as a task in the shared folder, with the following layout:
+#
+#   SHAREDIR/JOBID/inputs/      tiles, seed tiles and style image of the job
+#   SHAREDIR/JOBID/tasks/       one JSON file per task, describing how to stylize a tile
+#   SHAREDIR/JOBID/claims/      one file per task being processed, created atomically by the worker that claims it
+#   SHAREDIR/JOBID/results/     stylized tiles, with the metrics of the worker that produced them
+#   SHAREDIR/JOBID/errors/      error messages of failed tasks
+#   SHAREDIR/JOBID/coordinator  kept updated by the coordinator while it waits for the results of the job
+#
+# Workers keep the modification time of their claims updated while working. Claims not updated in a while are
+# considered stale and are removed by the coordinator, so that other workers can take over the task. Likewise, jobs
+# whose coordinator file is not updated in a while are considered abandoned, and workers skip their tasks. Jobs
+# cancelled by their coordinator are renamed to a hidden folder before being removed.
+import json
+import logging
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from os.path import isfile, isdir, join
+from neuralstyle import metrics
+from neuralstyle.utils import fileext
+
+LOGGER = logging.getLogger(__name__)
+
+# Seconds after which a claim not updated by its worker is considered stale
+CLAIM_TIMEOUT = 300
+# Seconds between updates of a claim by its worker
+HEARTBEAT = 30
+# Seconds between checks of the shared folder
+POLL = 2
+
+
+class TaskError(RuntimeError):
+    """A distributed task failed in its worker"""
+    pass
+
+
+def publish(sharedir, tiles, seedtiles, style, params, taskparams=None):
+    """Publishes the tiles of a job as tasks in a shared folder
+
+    The tiles, seed tiles (None for no seed) and style are copied to the shared folder. The params dictionary holds
+    the options of the style transfer (alg, weight, stylescale, algparams, ...), which are included in each task.
+    Options specific to each tile can be given as a list of dictionaries in taskparams.
+
+    Returns the identifier of the published job.
+    """
+    jobid = uuid.uuid4().hex
+    jobdir = join(sharedir, jobid)
+    for folder in ["inputs", "tasks", "claims", "results", "errors"]:
+        os.makedirs(join(jobdir, folder))
+    atomicwrite(join(jobdir, "coordinator"), socket.gethostname())
+    shutil.copyfile(style, join(jobdir, "inputs", "style" + fileext(style)))
+    if taskparams is None:
+        taskparams = [{}] * len(tiles)
+    for i, (tile, seedtile, tileparams) in enumerate(zip(tiles, seedtiles, taskparams)):
+        task = dict(params, **tileparams)
+        task.update(task="%05d" % i, tile="inputs/tile_%d.png" % i, style="inputs/style" + fileext(style),
+                    seed=None)
+        shutil.copyfile(tile, join(jobdir, task["tile"]))
+        if seedtile is not None:
+            task["seed"] = "inputs/seed_%d.png" % i
+            shutil.copyfile(seedtile, join(jobdir, task["seed"]))
+        atomicwrite(join(jobdir, "tasks", task["task"] + ".json"), json.dumps(task))
+    LOGGER.info("Published job %s with %d tiles in %s" % (jobid, len(tiles), sharedir))
+    return jobid
+
+
+def collect(sharedir, jobid, outfiles, timeout=CLAIM_TIMEOUT, poll=POLL, onresult=None):
+    """Waits until all tasks of a job have been completed, and copies their results to the given files
+
+    Results are copied as soon as they are posted, and if an onresult function is given, onresult(index) is called
+    after copying the result of each task, with the index of the task in the job. Claims not updated by their workers
+    in timeout seconds are removed so that the task can be claimed again. The metrics reported by the workers are
+    charged to the active job. Once all results are collected, the job is removed from the shared folder. Raises
+    TaskError if any task fails, after cancelling the job.
+    """
+    jobdir = join(sharedir, jobid)
+    try:
+        collecttasks(jobdir, jobid, outfiles, timeout, poll, onresult)
+    except BaseException:
+        cancel(sharedir, jobid)
+        raise
+    shutil.rmtree(jobdir, ignore_errors=True)
+
+
+def collecttasks(jobdir, jobid, outfiles, timeout, poll, onresult=None):
+    """Waits until all tasks of a job have been completed, copying their results to the given files as they arrive"""
+    tasks = sorted(name[:-len(".json")] for name in os.listdir(join(jobdir, "tasks")))
+    if len(tasks) != len(outfiles):
+        raise ValueError("Job %s has %d tasks, but %d output files were given" % (jobid, len(tasks), len(outfiles)))
+    pending = set(tasks)
+    while pending:
+        os.utime(join(jobdir, "coordinator"))
+        for index, task in enumerate(tasks):
+            if task not in pending:
+                continue
+            if isfile(join(jobdir, "errors", task + ".txt")):
+                with open(join(jobdir, "errors", task + ".txt")) as f:
+                    raise TaskError("Task %s of job %s failed: %s" % (task, jobid, f.read()))
+            if isfile(join(jobdir, "results", task + ".png")):
+                copyresult(jobdir, task, outfiles[index])
+                pending.remove(task)
+                if onresult is not None:
+                    onresult(index)
+                continue
+            claim = join(jobdir, "claims", task + ".claim")
+            try:
+                if time.time() - os.path.getmtime(claim) > timeout:
+                    LOGGER.warning("Claim of task %s of job %s is stale, releasing it" % (task, jobid))
+                    os.remove(claim)
+            except OSError:
+                pass
+        if pending:
+            time.sleep(poll)
+
+
+def copyresult(jobdir, task, outfile):
+    """Copies the result of a completed task to a file, charging the metrics reported by its worker to the active job"""
+    shutil.copyfile(join(jobdir, "results", task + ".png"), outfile)
+    if isfile(join(jobdir, "results", task + ".json")):
+        with open(join(jobdir, "results", task + ".json")) as f:
+            taskmetrics = json.load(f)
+        metrics.record(**{key: taskmetrics[key] for key in ["gpuseconds", "algorithmruns", "oomretries"]})
+
+
+def cancel(sharedir, jobid):
+    """Cancels a job, so that workers stop claiming its tasks, and removes it from the shared folder
+
+    Workers still running a task of the job drop its result once they find the job gone.
+    """
+    jobdir = join(sharedir, jobid)
+    cancelled = join(sharedir, ".%s.cancelled" % jobid)
+    try:
+        os.rename(jobdir, cancelled)
+    except OSError:
+        cancelled = jobdir
+    shutil.rmtree(cancelled, ignore_errors=True)
+
+
+def work(sharedir, runner, workerid=None, idletimeout=None, heartbeat=HEARTBEAT, poll=POLL):
+    """Runs a worker that claims tasks from a shared folder and processes them until no tasks are left
+
+    Each claimed task is processed by calling runner(task, outfile), where task is the dictionary describing the
+    task, with absolute paths to its tile, seed and style. If idletimeout is None the worker never stops, else it
+    stops after idletimeout seconds without finding any task.
+
+    Returns the number of tasks processed.
+    """
+    if workerid is None:
+        workerid = "%s-%d" % (socket.gethostname(), os.getpid())
+    processed = 0
+    idlesince = time.time()
+    while True:
+        task = claimnext(sharedir, workerid)
+        if task is None:
+            if idletimeout is not None and time.time() - idlesince > idletimeout:
+                return processed
+            time.sleep(poll)
+            continue
+        try:
+            runtask(task, runner, workerid, heartbeat)
+        except OSError:
+            # The job folder was removed while the task was running
+            if isdir(task["jobdir"]):
+                raise
+            LOGGER.warning("Job %s is gone, dropping task %s" % (task["jobdir"], task["task"]))
+        processed += 1
+        idlesince = time.time()
+
+
+def claimnext(sharedir, workerid):
+    """Claims the next available task in the shared folder. Returns the claimed task, or None if none available"""
+    if not isdir(sharedir):
+        return None
+    for jobid in sorted(os.listdir(sharedir)):
+        jobdir = join(sharedir, jobid)
+        if jobid.startswith(".") or isabandoned(jobdir):
+            continue
+        try:
+            tasks = sorted(os.listdir(join(jobdir, "tasks")))
+        except OSError:
+            continue
+        for taskfile in tasks:
+            task = taskfile[:-len(".json")]
+            if isfile(join(jobdir, "results", task + ".png")) or isfile(join(jobdir, "errors", task + ".txt")):
+                continue
+            try:
+                fd = os.open(join(jobdir, "claims", task + ".claim"), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError:
+                continue
+            os.write(fd, workerid.encode("utf-8"))
+            os.close(fd)
+            # The task might have been finished by the worker that held the previous claim
+            if isfile(join(jobdir, "results", task + ".png")) or isfile(join(jobdir, "errors", task + ".txt")):
+                releaseclaim(join(jobdir, "claims", task + ".claim"), workerid)
+                continue
+            try:
+                with open(join(jobdir, "tasks", taskfile)) as f:
+                    description = json.load(f)
+            except (OSError, ValueError):
+                # The job was removed after listing its tasks
+                continue
+            description["jobdir"] = jobdir
+            for key in ["tile", "seed", "style"]:
+                if description[key] is not None:
+                    description[key] = join(jobdir, description[key])
+            return description
+    return None
+
+
+def isabandoned(jobdir, timeout=CLAIM_TIMEOUT):
+    """Returns whether the coordinator of a job stopped waiting for its results timeout seconds ago or more"""
+    try:
+        return time.time() - os.path.getmtime(join(jobdir, "coordinator")) > timeout
+    except OSError:
+        return True
+
+
+def runtask(task, runner, workerid, heartbeat=HEARTBEAT):
+    """Processes a claimed task, keeping its claim alive, and posts its result or error to the shared folder"""
+    jobdir = task["jobdir"]
+    claim = join(jobdir, "claims", task["task"] + ".claim")
+    LOGGER.info("Worker %s processing task %s of %s" % (workerid, task["task"], jobdir))
+
+    # Keep the claim alive while working
+    done = threading.Event()
+    keepalive = threading.Thread(target=touchclaim, args=(claim, done, heartbeat), daemon=True)
+    keepalive.start()
+
+    tmpresult = join(jobdir, "results", "%s.%s.tmp.png" % (task["task"], workerid))
+    taskmetrics = metrics.JobMetrics(tmpresult, task["tile"], task["style"], task.get("alg"))
+    try:
+        with metrics.trackjob(taskmetrics):
+            runner(task, tmpresult)
+        atomicwrite(join(jobdir, "results", task["task"] + ".json"), json.dumps(taskmetrics.asdict()))
+        os.replace(tmpresult, join(jobdir, "results", task["task"] + ".png"))
+    except Exception as e:
+        if not isdir(jobdir):
+            LOGGER.warning("Job %s was removed or cancelled while worker %s processed task %s, dropping it" %
+                           (jobdir, workerid, task["task"]))
+        else:
+            LOGGER.exception("Worker %s failed processing task %s" % (workerid, task["task"]))
+            try:
+                atomicwrite(join(jobdir, "errors", task["task"] + ".txt"), "%s: %s" % (workerid, str(e)))
+            except OSError:
+                LOGGER.warning("Unable to post error of task %s to %s" % (task["task"], jobdir))
+    finally:
+        done.set()
+        keepalive.join()
+        releaseclaim(claim, workerid)
+
+
+def releaseclaim(claim, workerid):
+    """Removes a claim, unless it was released as stale and now belongs to another worker"""
+    try:
+        with open(claim) as f:
+            if f.read() != workerid:
+                return
+        os.remove(claim)
+    except OSError:
+        pass
+
+
+def touchclaim(claim, done, heartbeat):
+    """Updates the modification time of a claim every heartbeat seconds, until done is set"""
+    while not done.wait(heartbeat):
+        try:
+            os.utime(claim)
+        except OSError:
+            pass
+
+
+def atomicwrite(path, text):
+    """Writes a text file so that readers never see it partially written"""
+    tmppath = path + ".tmp"
+    with open(tmppath, "w") as f:
+        f.write(text)
+    os.replace(tmppath, path)
@@ -0,0 +1,182 @@
+# Fingerprinting of input images, to avoid repeating style transfers over duplicated inputs
+#
+# Images are fingerprinted by a digest of their decoded pixels, so that the same image saved under different names
+# or formats is recognized, and optionally by a perceptual hash, so that slightly different versions of an image
+# (e.g. re-encoded with a lossy format) are also recognized. As the perceptual hash only looks at colors, near
+# duplicates must also have the same transparency, so that copied results keep the alpha channel of their content. Fingerprints and the results produced from them are kept
+# in a persistent index, so that repeated inputs are also recognized across runs.
+import hashlib
+import json
+import logging
+import os
+import time
+from os.path import abspath, dirname, expanduser, getmtime, getsize, isfile
+import numpy as np
+from neuralstyle.imagemagick import readimage
+from neuralstyle.checkpoints import filedigest
+
+LOGGER = logging.getLogger(__name__)
+
+# File with the index of fingerprints and results
+INDEX_FILE = os.environ.get("NEURALSTYLE_INDEX", expanduser("~/.neuralstyle/fingerprints.json"))
+INDEX = None
+# Side of the grid of low frequencies used by the perceptual hash, which has PHASH_SIZE**2 bits
+PHASH_SIZE = 8
+# Maximum number of differing bits for two perceptual hashes to be considered the same image
+PHASH_THRESHOLD = 6
+
+
+def index():
+    """Returns the index of fingerprints of files, and of results produced by style transfer jobs"""
+    global INDEX
+    if INDEX is None:
+        INDEX = {"files": {}, "results": {}}
+        if isfile(INDEX_FILE):
+            with open(INDEX_FILE, "r") as f:
+                INDEX = json.load(f)
+    return INDEX
+
+
+def saveindex():
+    """Saves the index of fingerprints to disk"""
+    try:
+        os.makedirs(dirname(INDEX_FILE), exist_ok=True)
+        tmpfile = INDEX_FILE + ".%d.tmp" % os.getpid()
+        with open(tmpfile, "w") as f:
+            json.dump(index(), f)
+        os.replace(tmpfile, INDEX_FILE)
+    except OSError:
+        LOGGER.warning("Unable to save fingerprints index to %s" % INDEX_FILE)
+
+
+def fingerprint(imfile, perceptual=False):
+    """Returns the fingerprint of an image file, as a dictionary with the digest of its pixels and its shape
+
+    If perceptual is True the fingerprint also includes a perceptual hash and a digest of the alpha channel.
+    Fingerprints are looked up in the index by path, size and modification time, and only computed if not found.
+    """
+    stat = {"size": getsize(imfile), "mtime": getmtime(imfile)}
+    known = index()["files"].get(abspath(imfile))
+    if known is not None and all(known[key] == value for key, value in stat.items()) and \
+            (not perceptual or "alpha" in known):
+        return known
+    pixels = readimage(imfile)
+    known = dict(stat, digest=pixeldigest(pixels), shape=[pixels.shape[1], pixels.shape[0]])
+    if perceptual:
+        known["phash"] = perceptualhash(pixels)
+        known["alpha"] = alphadigest(pixels)
+    index()["files"][abspath(imfile)] = known
+    return known
+
+
+def pixeldigest(pixels):
+    """Returns a digest of an array of pixels"""
+    digest = hashlib.sha1(str(pixels.shape).encode("utf-8"))
+    digest.update(np.ascontiguousarray(pixels).tobytes())
+    return digest.hexdigest()
+
+
+def alphadigest(pixels):
+    """Returns a digest of the alpha channel of an array of pixels, or None if the image is fully opaque"""
+    if pixels.shape[2] < 4 or (pixels[..., 3] == 255).all():
+        return None
+    return pixeldigest(pixels[..., 3])
+
+
+def perceptualhash(pixels):
+    """Returns the DCT perceptual hash of an array of RGBA pixels, as an hexadecimal string
+
+    The image is reduced to a 32x32 grayscale thumbnail, and each bit of the hash tells whether a low frequency
+    coefficient of its discrete cosine transform is above the median.
+    """
+    gray = pixels[..., :3].astype(float).mean(axis=2)
+    # Area average into a 32x32 thumbnail
+    side = 4 * PHASH_SIZE
+    rows = np.linspace(0, gray.shape[0], side + 1).astype(int)[:-1]
+    cols = np.linspace(0, gray.shape[1], side + 1).astype(int)[:-1]
+    counts = np.outer(np.diff(np.append(rows, gray.shape[0])), np.diff(np.append(cols, gray.shape[1])))
+    counts = np.maximum(counts, 1)
+    thumbnail = np.add.reduceat(np.add.reduceat(gray, rows, axis=0), cols, axis=1) / counts
+    # DCT-II through its basis matrix, keeping the lowest frequencies except the constant term
+    k = np.arange(side)
+    basis = np.cos(np.pi * (2 * k[np.newaxis, :] + 1) * k[:, np.newaxis] / (2.0 * side))
+    coefficients = (basis @ thumbnail @ basis.T)[:PHASH_SIZE, :PHASH_SIZE].ravel()[1:]
+    bits = np.append(coefficients > np.median(coefficients), False)
+    return "%0*x" % (PHASH_SIZE ** 2 // 4, int("".join("1" if bit else "0" for bit in bits), 2))
+
+
+def hamming(hash1, hash2):
+    """Returns the number of differing bits between two hexadecimal hashes"""
+    return bin(int(hash1, 16) ^ int(hash2, 16)).count("1")
+
+
+def canonical(imfiles, perceptual=False):
+    """Maps each image file to the first file in the list with the same image
+
+    Images are the same if their pixels are equal, or if perceptual is True, if their perceptual hashes differ in
+    at most PHASH_THRESHOLD bits and their alpha channels are equal.
+    """
+    representatives = []
+    mapping = {}
+    for imfile in imfiles:
+        if imfile in mapping:
+            continue
+        fp = fingerprint(imfile, perceptual)
+        for other, otherfp in representatives:
+            if fp["digest"] == otherfp["digest"] or (perceptual and fp["alpha"] == otherfp["alpha"] and
+                                                     hamming(fp["phash"], otherfp["phash"]) <= PHASH_THRESHOLD):
+                LOGGER.info("%s is a duplicate of %s" % (imfile, other))
+                mapping[imfile] = other
+                break
+        else:
+            representatives.append((imfile, fp))
+            mapping[imfile] = imfile
+    return mapping
+
+
+def dedupgrid(grid, perceptual=False):
+    """Splits a list of jobs into those that must be run and those that duplicate another job
+
+    Returns the list of jobs to run, and a list of (job, original) pairs, where the result of the original job can be
+    used as result of the duplicated one.
+    """
+    contents = canonical([spec["content"] for spec in grid], perceptual)
+    styles = canonical([spec["style"] for spec in grid], perceptual)
+    originals = {}
+    unique, duplicates = [], []
+    for spec in grid:
+        key = (contents[spec["content"]], styles[spec["style"]], spec["weight"], spec["stylescale"])
+        if key in originals:
+            duplicates.append((spec, originals[key]))
+        else:
+            originals[key] = spec
+            unique.append(spec)
+    saveindex()
+    return unique, duplicates
+
+
+def resultkey(spec, params):
+    """Returns the key identifying the result of a job in the index, from its input pixels and all its options"""
+    description = {
+        "content": fingerprint(spec["content"])["digest"], "style": fingerprint(spec["style"])["digest"],
+        "weight": spec["weight"], "stylescale": spec["stylescale"], "params": params
+    }
+    return hashlib.sha1(json.dumps(description, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def previousresult(spec, params):
+    """Returns a result file produced in a previous run for the same job, or None if there is none available
+
+    Results are only returned if the file has not been modified since it was produced.
+    """
+    known = index()["results"].get(resultkey(spec, params))
+    if known is None or not isfile(known["file"]) or filedigest(known["file"]) != known["digest"]:
+        return None
+    return known["file"]
+
+
+def recordresult(spec, params):
+    """Records in the index the result file of a finished job"""
+    index()["results"][resultkey(spec, params)] = {"file": abspath(spec["outfile"]),
+                                                   "digest": filedigest(spec["outfile"]), "time": time.time()}
+    saveindex()
@@ -1,6 +1,7 @@
 # Convenience functions to perform Image Magicks
 from subprocess import run, PIPE
 from glob import glob
+import numpy as np
 from neuralstyle.utils import filename
 
 
@@ -45,6 +46,17 @@ def choptiles(imfile, xtiles, ytiles, overlap, outname):
     return sorted(glob(outname + "_*.png"), key=lambda x: int(filename(x).split("_")[-1]))
 
 
+def croptiles(imfile, boxes, outname):
+    """Crops an image file into tiles given by boxes (x, y, width, height). Returns ordered list of tiles image files"""
+    tiles = []
+    for i, (x, y, width, height) in enumerate(boxes):
+        tile = "%s_%d.png" % (outname, i)
+        command = "convert %s -crop %dx%d+%d+%d +repage %s" % (imfile, width, height, x, y, tile)
+        run(command, shell=True, check=True)
+        tiles.append(tile)
+    return tiles
+
+
 def feather(imfile, outname):
     """Produces a feathered version of an image. Note the output format must allow for an alpha channel"""
     command = 'convert %s -alpha set -virtual-pixel transparent -channel A -morphology Distance Euclidean:1,50\! ' \
@@ -70,8 +82,17 @@ def smush(tiles, xtiles, ytiles, smushw, smushh, outname):
     run(command, shell=True, check=True)
 
 
-def composite(imfiles, outname):
-    """Blends several image files together"""
+def composite(imfiles, outname, shp=None):
+    """Blends several image files together
+
+    If a shape is given, two images are blended and the result is resized to that shape in the same pass.
+    """
+    if shp is not None:
+        if len(imfiles) != 2:
+            raise ValueError("Only two images can be blended and resized at once, %d given" % len(imfiles))
+        command = "convert %s %s -composite -resize %dx%d! %s" % (imfiles[1], imfiles[0], shp[0], shp[1], outname)
+        run(command, shell=True, check=True)
+        return
     command = "composite"
     for imfile in imfiles:
         command += " " + imfile
@@ -114,6 +135,31 @@ def equalimages(imfile1, imfile2):
     return result.returncode == 0
 
 
+def readimage(imfile):
+    """Decodes an image file into an array of shape (height, width, 4) with its 8-bit RGBA values"""
+    width, height = shape(imfile)[:2]
+    result = run("convert %s -depth 8 rgba:-" % imfile, shell=True, check=True, stdout=PIPE)
+    return np.frombuffer(result.stdout, dtype=np.uint8).reshape(height, width, 4)
+
+
+def writeimage(pixels, imfile, maxsize=None, quality=None, stripalpha=False):
+    """Encodes an array of shape (height, width, 4) with 8-bit RGBA values into an image file
+
+    Optionally the image is shrunk to fit in a square of maxsize pixels, encoded with the given quality, or
+    flattened over a white background to remove its alpha channel.
+    """
+    height, width = pixels.shape[:2]
+    command = "convert -size %dx%d -depth 8 rgba:-" % (width, height)
+    if maxsize is not None:
+        command += " -resize '%dx%d>'" % (maxsize, maxsize)
+    if stripalpha:
+        command += " -background white -alpha remove -alpha off"
+    if quality is not None:
+        command += " -quality %d" % quality
+    command += " " + imfile
+    run(command, shell=True, check=True, input=np.ascontiguousarray(pixels, dtype=np.uint8).tobytes())
+
+
 def ismultilayer(imfile):
     """Returns whether an image file contains multiple layers"""
     return len(shape(imfile)) > 2
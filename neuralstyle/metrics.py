@@ -0,0 +1,173 @@
+# Per-job resource accounting and metrics export
+import json
+import os
+import resource
+import time
+from contextlib import contextmanager
+
+# Job currently being accounted, if any. Style transfer routines report their usage here, so that nested calls
+# (tiles, multiresolution steps) are charged to the job that triggered them.
+_ACTIVE = None
+
+
+class JobMetrics:
+    """Resources consumed by a single style transfer job (one combination of content, style, weight and scale)"""
+
+    def __init__(self, outfile, content, style, alg, weight=None, stylescale=None):
+        self.outfile = outfile
+        self.content = content
+        self.style = style
+        self.alg = alg
+        self.weight = weight
+        self.stylescale = stylescale
+        self.gpuseconds = 0.0
+        self.cpuseconds = 0.0
+        self.wallseconds = 0.0
+        self.algorithmruns = 0
+        self.tiles = 0
+        self.multiresolutionsteps = 0
+        self.peakdiskbytes = 0
+        self.cachehits = 0
+        self.oomretries = 0
+        self.encodeseconds = 0.0
+        self.outputs = []
+        self.workdirs = []
+
+    def asdict(self):
+        """Returns the metrics as a JSON-serializable dictionary"""
+        return {key: value for key, value in vars(self).items() if key != "workdirs"}
+
+    def __repr__(self):
+        return "JobMetrics(%s)" % ", ".join("%s=%r" % item for item in self.asdict().items())
+
+
+def active():
+    """Returns the job currently being accounted, or None if no job is being tracked"""
+    return _ACTIVE
+
+
+@contextmanager
+def trackjob(job):
+    """Context manager that charges all resource usage inside it to the given JobMetrics object
+
+    GPU time is measured as the wall time of the style transfer processes, CPU time as the user plus system time of
+    all child processes (style transfer and ImageMagick) finished while the job was active.
+    """
+    global _ACTIVE
+    previous = _ACTIVE
+    _ACTIVE = job
+    start = time.perf_counter()
+    startcpu = _childrencpu()
+    try:
+        yield job
+    finally:
+        sampledisk()
+        job.wallseconds += time.perf_counter() - start
+        job.cpuseconds += _childrencpu() - startcpu
+        job.workdirs = []
+        _ACTIVE = previous
+
+
+def record(**increments):
+    """Adds the given amounts to the counters of the active job. Does nothing if no job is being tracked"""
+    if _ACTIVE is None:
+        return
+    for key, value in increments.items():
+        setattr(_ACTIVE, key, getattr(_ACTIVE, key) + value)
+
+
+def split(source, targets, shares):
+    """Charges the usage accounted in a JobMetrics object to several jobs, in proportion to the given shares
+
+    Used when a single algorithm invocation serves several jobs at once. Peak disk usage is not split, as the
+    temporary files were alive for all jobs at the same time.
+    """
+    total = float(sum(shares))
+    for target, share in zip(targets, shares):
+        for key in ["gpuseconds", "cpuseconds", "wallseconds", "algorithmruns"]:
+            setattr(target, key, getattr(target, key) + getattr(source, key) * share / total)
+        target.peakdiskbytes = max(target.peakdiskbytes, source.peakdiskbytes)
+
+
+def registerworkdir(path):
+    """Registers a temporary folder whose disk usage should be charged to the active job"""
+    if _ACTIVE is not None:
+        _ACTIVE.workdirs.append(path)
+
+
+def sampledisk():
+    """Measures the disk usage of the live temporary folders of the active job, updating its peak usage"""
+    if _ACTIVE is None:
+        return
+    _ACTIVE.workdirs = [path for path in _ACTIVE.workdirs if os.path.isdir(path)]
+    usage = sum(_dirsize(path) for path in _ACTIVE.workdirs)
+    _ACTIVE.peakdiskbytes = max(_ACTIVE.peakdiskbytes, usage)
+
+
+def appendledger(ledgerfile, job):
+    """Appends the metrics of a job as a new line to a JSONL ledger file"""
+    with open(ledgerfile, "a") as f:
+        f.write(json.dumps(dict(job.asdict(), timestamp=time.time())) + "\n")
+
+
+def writeprometheus(promfile, jobs):
+    """Writes the aggregated metrics of a list of jobs in Prometheus text exposition format
+
+    The file is written atomically, as required by the node-exporter textfile collector.
+    """
+    counters = [
+        ("jobs", "Style transfer jobs completed", lambda job: 1),
+        ("gpu_seconds", "GPU seconds spent running style transfer algorithms", lambda job: job.gpuseconds),
+        ("cpu_seconds", "CPU seconds spent by child processes", lambda job: job.cpuseconds),
+        ("wall_seconds", "Wall clock seconds spent", lambda job: job.wallseconds),
+        ("algorithm_runs", "Invocations of style transfer algorithms", lambda job: job.algorithmruns),
+        ("tiles", "Tiles processed", lambda job: job.tiles),
+        ("multiresolution_steps", "Multiresolution steps processed", lambda job: job.multiresolutionsteps),
+        ("cache_hits", "Work units served from cache", lambda job: job.cachehits),
+        ("oom_retries", "Retries after running out of GPU memory", lambda job: job.oomretries),
+        ("encode_seconds", "Wall clock seconds spent encoding output variants", lambda job: job.encodeseconds),
+    ]
+    algs = sorted(set(job.alg for job in jobs))
+    lines = []
+    for name, description, getter in counters:
+        lines.append("# HELP neuralstyle_last_run_%s %s in the last run" % (name, description))
+        lines.append("# TYPE neuralstyle_last_run_%s gauge" % name)
+        for alg in algs:
+            value = sum(getter(job) for job in jobs if job.alg == alg)
+            lines.append('neuralstyle_last_run_%s{alg="%s"} %s' % (name, _escapelabel(alg), value))
+    lines.append("# HELP neuralstyle_last_run_peak_disk_bytes Peak temporary disk usage of a job in the last run")
+    lines.append("# TYPE neuralstyle_last_run_peak_disk_bytes gauge")
+    for alg in algs:
+        value = max(job.peakdiskbytes for job in jobs if job.alg == alg)
+        lines.append('neuralstyle_last_run_peak_disk_bytes{alg="%s"} %d' % (_escapelabel(alg), value))
+    lines.append("# HELP neuralstyle_last_run_timestamp_seconds Time at which the last run finished")
+    lines.append("# TYPE neuralstyle_last_run_timestamp_seconds gauge")
+    lines.append("neuralstyle_last_run_timestamp_seconds %f" % time.time())
+
+    tmpfile = promfile + ".tmp"
+    with open(tmpfile, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmpfile, promfile)
+
+
+def _childrencpu():
+    """Returns the CPU time (user + system) consumed so far by finished child processes"""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _dirsize(path):
+    """Returns the total size in bytes of the files inside a folder"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _escapelabel(value):
+    """Escapes a Prometheus label value"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,97 @@
+# Encoding of the results of style transfer into several output variants
+#
+# Each variant is described by an output spec dictionary with the following keys:
+#
+#   format      file format (extension) of the variant, e.g. "png", "jpg" or "webp"
+#   quality     encoding quality, or None for the format default
+#   maxsize     maximum width and height of the variant, or None to keep the full size
+#   stripalpha  whether to flatten the image over a white background, removing its alpha channel
+#
+# Specs can also be given as strings FORMAT[:qQUALITY][:maxMAXSIZE][:noalpha], e.g. "jpg:q85:max1024".
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os.path import abspath, dirname, getsize, join
+from neuralstyle.imagemagick import readimage, writeimage
+from neuralstyle.utils import filename
+
+LOGGER = logging.getLogger(__name__)
+
+# Formats that cannot store an alpha channel
+NOALPHA_FORMATS = ["jpg", "jpeg", "bmp"]
+
+
+def parseoutput(spec):
+    """Parses an output spec string into an output spec dictionary"""
+    fields = spec.split(":")
+    output = {"format": fields[0].lower().lstrip("."), "quality": None, "maxsize": None, "stripalpha": False}
+    if not output["format"]:
+        raise ValueError("Output spec %s lacks a format" % spec)
+    for field in fields[1:]:
+        if field.startswith("q"):
+            output["quality"] = int(field[1:])
+        elif field.startswith("max"):
+            output["maxsize"] = int(field[3:])
+        elif field == "noalpha":
+            output["stripalpha"] = True
+        else:
+            raise ValueError("Unrecognized option %s in output spec %s" % (field, spec))
+    return output
+
+
+def variantname(outfile, output):
+    """Returns the file name of an output variant of a result file
+
+    Raises ValueError if the variant would overwrite the result file itself.
+    """
+    name = join(dirname(outfile), filename(outfile))
+    if output["maxsize"] is not None:
+        name += "_max" + str(output["maxsize"])
+    if output["quality"] is not None:
+        name += "_q" + str(output["quality"])
+    if output["stripalpha"]:
+        name += "_noalpha"
+    name += "." + output["format"]
+    if abspath(name) == abspath(outfile):
+        raise ValueError("Output spec %s would overwrite result file %s" % (str(output), outfile))
+    return name
+
+
+def checkoutputs(outfile, outputs):
+    """Checks that a list of output specs produce valid variants of a result file
+
+    Returns the list of parsed output specs, and the list of their variant file names. Raises ValueError if any
+    variant would overwrite the result file, or if several variants share the same file name.
+    """
+    outputs = [parseoutput(output) if isinstance(output, str) else output for output in outputs]
+    names = [variantname(outfile, output) for output in outputs]
+    if len(set(names)) != len(names):
+        raise ValueError("Output specs %s produce repeated file names" % str(outputs))
+    return outputs, names
+
+
+def encodeoutputs(outfile, outputs, workers=None):
+    """Encodes a result file into several output variants
+
+    The result is decoded once, and all variants are encoded in parallel from the decoded pixels. Variants are saved
+    next to the result file, with names reflecting their options.
+
+    Returns a list of dictionaries with the file, encoding seconds and size in bytes of each variant.
+    """
+    outputs, names = checkoutputs(outfile, outputs)
+    pixels = readimage(outfile)
+
+    def encode(output, name):
+        start = time.perf_counter()
+        stripalpha = output["stripalpha"] or output["format"] in NOALPHA_FORMATS
+        writeimage(pixels, name, maxsize=output["maxsize"], quality=output["quality"], stripalpha=stripalpha)
+        return {"file": name, "seconds": time.perf_counter() - start, "bytes": getsize(name)}
+
+    if workers is None:
+        workers = min(len(outputs), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        variants = list(executor.map(encode, outputs, names))
+    for variant in variants:
+        LOGGER.info("Encoded %s in %.2f seconds (%d bytes)" % (variant["file"], variant["seconds"], variant["bytes"]))
+    return variants
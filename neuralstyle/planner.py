@@ -0,0 +1,176 @@
+# Dry-run planning of style transfer jobs: tile layouts, algorithm passes and resource estimates
+import json
+from collections import OrderedDict
+from math import ceil
+from neuralstyle.algorithms import (plugdefaults, jobgrid, targetshape, fitsingletile, tilegeometry,
+                                    multiresolutionsteps, numiterations, SWEEP_ITERFRACTION, SWEEP_MINITERS)
+
+# Cost model for each algorithm, roughly calibrated on a Tesla K80. Use calibrate to fit it to your hardware.
+#   startup: seconds to launch the algorithm and load its networks, per invocation
+#   seconds: seconds per megapixel processed (per megapixel and iteration for Gatys)
+#   basememory: GPU memory in bytes used regardless of image size
+#   memory: GPU memory in bytes per megapixel
+COSTMODEL = {
+    "gatys": {"startup": 10.0, "seconds": 0.4, "basememory": 1.5e9, "memory": 2.5e9},
+    "chen-schmidt": {"startup": 8.0, "seconds": 2.0, "basememory": 1.0e9, "memory": 1.5e9},
+    "chen-schmidt-inverse": {"startup": 5.0, "seconds": 0.5, "basememory": 1.0e9, "memory": 1.0e9}
+}
+
+# Temporary disk usage: bytes per pixel of intermediate images, and number of intermediate copies of the image
+TEMPBYTESPERPIXEL = 4
+SINGLECOPIES = 4
+TILEDCOPIES = 7
+
+
+def makeplan(contents, styles, savefolder, size=None, alg="gatys", weights=None, stylescales=None, tileoverlap=100,
+             algparams=None, sweep=False, shortestfirst=False, costmodel=None, batch=True, iterbudget=None):
+    """Plans the style transfer jobs for a grid of options without running them
+
+    For each job lists its tile layout and number of algorithm passes, together with its estimated runtime, peak GPU
+    memory and temporary disk usage. Tile sizes are those of the uniform tiling, which bound the ones of the adaptive
+    tiling. If shortestfirst is True, jobs are sorted by increasing estimated runtime, keeping warm started sweeps
+    together.
+
+    The batch and iterbudget options should be those given to styletransfer. If batch is True, Chen-Schmidt images and
+    tiles sharing style, scale and width are charged a single startup, split among them. If an iterbudget is given,
+    each tile of a tiled gatys job is estimated with iterbudget times the iterations, as the average of its budget.
+
+    Returns the plan as a JSON-serializable dictionary, which can be fed to styletransfer to run the jobs in order.
+    """
+    if costmodel is None:
+        costmodel = COSTMODEL
+    weights, stylescales, tileoverlap, algparams, sweep = plugdefaults(alg, weights, stylescales, tileoverlap,
+                                                                       algparams, sweep)
+    batched = batch and alg in ["chen-schmidt", "chen-schmidt-inverse"]
+    batches = OrderedDict()
+    jobs = []
+    for spec in jobgrid(contents, styles, savefolder, alg, weights, stylescales, sweep):
+        fullshape = targetshape(spec["content"], size)
+        if fitsingletile(fullshape, alg):
+            tiling = None
+            units = [fullshape]
+            copies = SINGLECOPIES
+        else:
+            xtiles, ytiles = tilegeometry(fullshape, alg, tileoverlap)
+            tileshape = [int(ceil((fullshape[0] + (xtiles - 1) * tileoverlap) / float(xtiles))),
+                         int(ceil((fullshape[1] + (ytiles - 1) * tileoverlap) / float(ytiles)))]
+            tiling = {"xtiles": xtiles, "ytiles": ytiles, "overlap": tileoverlap, "tileshape": tileshape}
+            units = [tileshape] * (xtiles * ytiles)
+            copies = TILEDCOPIES
+        unitpasses = [algorithmpasses(alg, unit, algparams, warmstart=spec["initimage"] is not None,
+                                      iterbudget=iterbudget if tiling is not None else None) for unit in units]
+        estimates = [estimate(alg, p, costmodel, startup=not batched) for p in unitpasses]
+        if batched:
+            for unit in units:
+                batches.setdefault((spec["style"], spec["stylescale"], unit[0]), []).append(len(jobs))
+        jobs.append(dict(spec, **{
+            "shape": fullshape,
+            "tiling": tiling,
+            "passes": sum(len(p) for p in unitpasses),
+            "estimatedseconds": sum(seconds for seconds, _ in estimates),
+            "estimatedpeakmemory": max(memory for _, memory in estimates),
+            "estimateddisk": TEMPBYTESPERPIXEL * copies * fullshape[0] * fullshape[1]
+        }))
+
+    # Each batch launches the algorithm once, and its startup is shared among the images and tiles in it
+    for members in batches.values():
+        for index in members:
+            jobs[index]["estimatedseconds"] += costmodel[alg]["startup"] / len(members)
+
+    if shortestfirst:
+        jobs = [job for chain in sorted(sweepchains(jobs), key=lambda c: sum(j["estimatedseconds"] for j in c))
+                for job in chain]
+
+    return {
+        "alg": alg,
+        "size": size,
+        "tileoverlap": tileoverlap,
+        "algparams": [str(p) for p in algparams],
+        "jobs": jobs,
+        "totals": {
+            "jobs": len(jobs),
+            "tiles": sum(job["tiling"]["xtiles"] * job["tiling"]["ytiles"] if job["tiling"] else 1 for job in jobs),
+            "passes": sum(job["passes"] for job in jobs),
+            "estimatedseconds": sum(job["estimatedseconds"] for job in jobs),
+            "estimatedpeakmemory": max([job["estimatedpeakmemory"] for job in jobs] + [0]),
+            "estimateddisk": max([job["estimateddisk"] for job in jobs] + [0])
+        }
+    }
+
+
+def algorithmpasses(alg, unitshape, algparams, warmstart=False, iterbudget=None):
+    """Lists the algorithm invocations required to stylize a single image or tile of the given shape
+
+    If an iterbudget is given, gatys runs iterbudget times its iterations, as the average tile of a budgeted job.
+    Returns a list of dictionaries with the shape and number of iterations (None if not iterative) of each pass.
+    """
+    if alg == "gatys":
+        iterations = numiterations(algparams)
+        if iterbudget is not None:
+            iterations = int(round(iterations * iterbudget))
+        if warmstart:
+            iterations = max(SWEEP_MINITERS, int(iterations * SWEEP_ITERFRACTION))
+        return [{"shape": unitshape, "iterations": iterations}]
+    elif alg == "gatys-multiresolution":
+        return [{"shape": [res, int(res * unitshape[1] / unitshape[0])], "iterations": int(iters)}
+                for _, _, res, _, iters in multiresolutionsteps(unitshape[0])]
+    else:
+        return [{"shape": unitshape, "iterations": None}]
+
+
+def estimate(alg, passes, costmodel, startup=True):
+    """Estimates the runtime in seconds and peak GPU memory in bytes of a list of algorithm passes
+
+    If startup is False, the time to launch the algorithm is not included, as for passes run as part of a batch.
+    """
+    model = costmodel["gatys" if alg == "gatys-multiresolution" else alg]
+    seconds = 0.0
+    memory = 0.0
+    for p in passes:
+        megapixels = p["shape"][0] * p["shape"][1] / 1e6
+        work = megapixels * (p["iterations"] if p["iterations"] is not None else 1)
+        seconds += (model["startup"] if startup else 0.0) + model["seconds"] * work
+        memory = max(memory, model["basememory"] + model["memory"] * megapixels)
+    return seconds, int(memory)
+
+
+def sweepchains(jobs):
+    """Splits a list of jobs in chains of jobs that must run consecutively, as each warm starts from the previous"""
+    chains = []
+    for job in jobs:
+        if job["initimage"] is None or not chains:
+            chains.append([])
+        chains[-1].append(job)
+    return chains
+
+
+def calibrate(plan, ledgerfile, costmodel=None):
+    """Fits the cost model to actual runtimes, given a plan and the metrics ledger of running it
+
+    The time coefficients of each algorithm are rescaled by the ratio between the measured GPU seconds and the
+    estimated seconds of the jobs in the plan. Returns the calibrated cost model.
+    """
+    if costmodel is None:
+        costmodel = COSTMODEL
+    with open(ledgerfile) as f:
+        measured = {entry["outfile"]: entry["gpuseconds"] for entry in map(json.loads, f)}
+    estimated = sum(job["estimatedseconds"] for job in plan["jobs"] if job["outfile"] in measured)
+    actual = sum(measured[job["outfile"]] for job in plan["jobs"] if job["outfile"] in measured)
+    calibrated = {alg: dict(model) for alg, model in costmodel.items()}
+    if estimated > 0 and actual > 0:
+        model = calibrated["gatys" if plan["alg"] == "gatys-multiresolution" else plan["alg"]]
+        model["startup"] *= actual / estimated
+        model["seconds"] *= actual / estimated
+    return calibrated
+
+
+def writeplan(plan, planfile):
+    """Saves a plan to a JSON file"""
+    with open(planfile, "w") as f:
+        json.dump(plan, f, indent=2)
+
+
+def loadplan(planfile):
+    """Loads a plan from a JSON file"""
+    with open(planfile) as f:
+        return json.load(f)
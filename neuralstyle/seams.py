@@ -0,0 +1,141 @@
+# Seam-aware tiling: content adaptive tile overlaps and minimum error seam blending
+from math import ceil
+import numpy as np
+
+# Smallest overlap allowed between two tiles, in pixels
+MINOVERLAP = 16
+# Ratio of the detail along an edge to the mean detail of the image at which the full overlap is used
+REFERENCEDETAIL = 2.0
+# Width in pixels of the transition between tiles around the seam
+SEAMSMOOTHING = 4
+
+
+def cutpositions(length, ntiles, overlap):
+    """Positions of the cuts between consecutive tiles along one dimension
+
+    Cuts are placed at the center of the overlaps produced by choptiles when using the same number of tiles and
+    overlap, so that using the maximum overlap at every edge reproduces the choptiles layout.
+    """
+    return [int(round(overlap / 2.0 + (k + 1) * (length - overlap) / float(ntiles))) for k in range(ntiles - 1)]
+
+
+def detailmap(pixels):
+    """Returns the gradient magnitude of the luminance of an image, as a cheap measure of local detail"""
+    gray = pixels[..., :3].astype(float).mean(axis=2)
+    gy, gx = np.gradient(gray)
+    return np.hypot(gx, gy)
+
+
+def edgeoverlap(detail, globaldetail, maxoverlap, minoverlap=MINOVERLAP):
+    """Chooses the overlap for an edge between tiles given the detail map of the image strip around that edge
+
+    Flat edges, where seams are easy to hide, get the minimum overlap, while edges with lots of detail get up to the
+    maximum overlap. The returned value is always even, so that the overlap can be split evenly among both tiles.
+    """
+    minoverlap = min(minoverlap, maxoverlap)
+    score = detail.mean() / (REFERENCEDETAIL * globaldetail) if globaldetail > 0 else 0.0
+    overlap = minoverlap + (maxoverlap - minoverlap) * min(1.0, score)
+    return min(2 * int(ceil(overlap / 2.0)), 2 * (maxoverlap // 2))
+
+
+def adaptivetiles(pixels, xtiles, ytiles, maxoverlap, minoverlap=MINOVERLAP):
+    """Computes a tiling of an image with a different overlap for each edge between tiles, adapted to image content
+
+    No tile is larger than the ones produced by choptiles with the same number of tiles and maxoverlap.
+
+    Returns a list of tile boxes (x, y, width, height) in row-major order, and a list with the overlap of each tile
+    with its left and top neighbours (0 if no such neighbour exists).
+    """
+    height, width = pixels.shape[:2]
+    detail = detailmap(pixels)
+    globaldetail = detail.mean()
+    xcuts = [0] + cutpositions(width, xtiles, maxoverlap) + [width]
+    ycuts = [0] + cutpositions(height, ytiles, maxoverlap) + [height]
+    half = maxoverlap // 2
+
+    # Overlap of the edge at the left and at the top of each tile
+    left = np.zeros((ytiles, xtiles), dtype=int)
+    top = np.zeros((ytiles, xtiles), dtype=int)
+    for row in range(ytiles):
+        for col in range(xtiles):
+            if col > 0:
+                strip = detail[ycuts[row]:ycuts[row+1], xcuts[col]-half:xcuts[col]+half]
+                left[row, col] = edgeoverlap(strip, globaldetail, maxoverlap, minoverlap)
+            if row > 0:
+                strip = detail[ycuts[row]-half:ycuts[row]+half, xcuts[col]:xcuts[col+1]]
+                top[row, col] = edgeoverlap(strip, globaldetail, maxoverlap, minoverlap)
+
+    boxes = []
+    overlaps = []
+    for row in range(ytiles):
+        for col in range(xtiles):
+            x0 = xcuts[col] - left[row, col] // 2
+            x1 = xcuts[col+1] + (left[row, col+1] // 2 if col + 1 < xtiles else 0)
+            y0 = ycuts[row] - top[row, col] // 2
+            y1 = ycuts[row+1] + (top[row+1, col] // 2 if row + 1 < ytiles else 0)
+            # Plain ints, so that layouts can be saved as JSON
+            boxes.append((int(x0), int(y0), int(x1 - x0), int(y1 - y0)))
+            overlaps.append((int(left[row, col]), int(top[row, col])))
+    return boxes, overlaps
+
+
+def minimumseam(cost):
+    """Finds the vertical path of minimum cost through a cost matrix, moving at most one column per row
+
+    Returns an array with the column of the seam at each row.
+    """
+    accumulated = cost.astype(float)
+    for i in range(1, accumulated.shape[0]):
+        previous = accumulated[i-1]
+        shiftedleft = np.concatenate(([np.inf], previous[:-1]))
+        shiftedright = np.concatenate((previous[1:], [np.inf]))
+        accumulated[i] += np.minimum(np.minimum(shiftedleft, previous), shiftedright)
+
+    seam = np.empty(accumulated.shape[0], dtype=int)
+    seam[-1] = np.argmin(accumulated[-1])
+    for i in range(accumulated.shape[0] - 2, -1, -1):
+        low = max(0, seam[i+1] - 1)
+        seam[i] = low + np.argmin(accumulated[i, low:seam[i+1]+2])
+    return seam
+
+
+def smoothmask(mask, radius):
+    """Applies a box blur of the given radius to a 2D mask, replicating its borders"""
+    for axis in [0, 1]:
+        padded = np.pad(mask, [(radius + 1, radius) if a == axis else (0, 0) for a in [0, 1]], mode="edge")
+        summed = np.cumsum(padded, axis=axis)
+        if axis == 0:
+            mask = (summed[2*radius+1:] - summed[:-2*radius-1]) / (2 * radius + 1)
+        else:
+            mask = (summed[:, 2*radius+1:] - summed[:, :-2*radius-1]) / (2 * radius + 1)
+    return mask
+
+
+def quilt(tiles, boxes, overlaps, imshape):
+    """Blends a list of tiles into a single image, cutting a minimum error seam through each overlap
+
+    Tiles are given as pixel arrays, together with the boxes and overlaps produced by adaptivetiles. Tiles are
+    placed in order, and each tile replaces the image built so far only at the side of the seams away from its
+    left and top neighbours.
+    """
+    width, height = imshape
+    canvas = np.zeros((height, width, tiles[0].shape[2]))
+    covered = np.zeros((height, width), dtype=bool)
+    for tile, (x, y, w, h), (left, top) in zip(tiles, boxes, overlaps):
+        tile = tile.astype(float)
+        region = canvas[y:y+h, x:x+w]
+        regioncovered = covered[y:y+h, x:x+w]
+        error = ((tile - region) ** 2).sum(axis=2)
+        error[~regioncovered] = 0
+        mask = np.ones((h, w))
+        if left > 0:
+            seam = minimumseam(error[:, :left])
+            mask[np.arange(w)[None, :] < seam[:, None]] = 0
+        if top > 0:
+            seam = minimumseam(error[:top, :].T)
+            mask[np.arange(h)[:, None] < seam[None, :]] = 0
+        mask = smoothmask(mask, SEAMSMOOTHING)
+        mask[~regioncovered] = 1
+        canvas[y:y+h, x:x+w] = mask[..., None] * tile + (1 - mask[..., None]) * region
+        covered[y:y+h, x:x+w] = True
+    return np.clip(np.rint(canvas), 0, 255).astype(np.uint8)
@@ -3,8 +3,13 @@
 #
 from tempfile import TemporaryDirectory
 from glob import glob
-from neuralstyle.algorithms import styletransfer, neuraltile, ALGORITHMS
-from neuralstyle.imagemagick import shape, equalimages
+from os import listdir
+from shutil import copyfile
+import neuralstyle.algorithms
+import neuralstyle.fingerprints
+from neuralstyle.algorithms import styletransfer, neuraltile, sweeporder, warmstartparams, batchgroups, \
+    chenschmidt_batch, jobgrid, chenschmidt_grid, isoutofmemory, OutOfMemoryError, ALGORITHMS
+from neuralstyle.imagemagick import shape, equalimages, convert
 from neuralstyle.utils import filename
 
 CONTENTS = "/app/entrypoint/tests/contents/"
@@ -113,6 +118,153 @@ def test_styletransfer_sw():
     assertalldifferent(tmpdir.name + "/" + filename(img) + "*cubism*", len(styleweights))
 
 
+def test_styletransfer_sweep():
+    """Warm started sweeps over style weights and scales produce all combinations"""
+    styleweights = [1, 5, 10]
+    stylescales = [0.75, 1]
+    img = "docker.png"
+    tmpdir = TemporaryDirectory()
+    styletransfer([CONTENTS + img], [STYLES + "cubism.jpg"], tmpdir.name, alg="gatys", size=100,
+                  weights=styleweights, stylescales=stylescales, sweep=True)
+    assertalldifferent(tmpdir.name + "/" + filename(img) + "*cubism*", len(styleweights) * len(stylescales))
+
+
+def test_sweeporder():
+    """Sweep order visits all combinations, each one neighbouring the previous"""
+    assert sweeporder([10, 1, 5], [1.25, 1]) == [(1, 1), (5, 1), (10, 1), (10, 1.25), (5, 1.25), (1, 1.25)]
+
+
+def test_warmstartparams():
+    """Warm start parameters reduce the number of iterations of the given parameters or the defaults"""
+    params = warmstartparams(["-num_iterations", "1000"], "seed.png")
+    assert params[:2] == ["-num_iterations", "1000"]
+    assert params[2:6] == ["-init", "image", "-init_image", "seed.png"]
+    assert params[-2:] == ["-num_iterations", 300]
+    assert warmstartparams([], "seed.png")[-2:] == ["-num_iterations", 150]
+
+
+def test_batchgroups():
+    """Batch units are grouped by style, scale and width, keeping their order"""
+    units = [{"style": "a", "stylescale": 1.0, "width": 500, "id": 0},
+             {"style": "b", "stylescale": 1.0, "width": 500, "id": 1},
+             {"style": "a", "stylescale": 1.0, "width": 500, "id": 2},
+             {"style": "a", "stylescale": 0.5, "width": 500, "id": 3},
+             {"style": "a", "stylescale": 1.0, "width": 200, "id": 4}]
+    groups = batchgroups(units)
+    assert list(groups.keys()) == [("a", 1.0, 500), ("b", 1.0, 500), ("a", 0.5, 500), ("a", 1.0, 200)]
+    assert [unit["id"] for unit in groups[("a", 1.0, 500)]] == [0, 2]
+
+
+def stubalgorithm(alg, params):
+    """Stub for runalgorithm that "stylizes" a batch of contents by copying them to the output folder"""
+    contentdir = params[params.index("--contentBatch") + 1]
+    savedir = params[params.index("--save") + 1]
+    stubalgorithm.calls += 1
+    stubalgorithm.sizes.append((params[params.index("--maxContentSize") + 1],
+                                [shape(contentdir + "/" + name)[0] for name in listdir(contentdir)]))
+    for name in listdir(contentdir):
+        copyfile(contentdir + "/" + name, savedir + "/" + filename(name) + "_stylized.png")
+
+
+def test_chenschmidt_batch_stub():
+    """Outputs of a batched Chen-Schmidt invocation are mapped back to the requested files"""
+    tmpdir = TemporaryDirectory()
+    contents = []
+    for name in ["docker.png", "goldengate.jpg", "obama.jpg"]:
+        contents.append(tmpdir.name + "/" + filename(name) + ".png")
+        convert(CONTENTS + name, contents[-1])
+    outfiles = [tmpdir.name + "/out_%d.png" % i for i in range(len(contents))]
+    original, neuralstyle.algorithms.runalgorithm = neuralstyle.algorithms.runalgorithm, stubalgorithm
+    stubalgorithm.calls = 0
+    stubalgorithm.sizes = []
+    try:
+        chenschmidt_batch("chen-schmidt", contents, STYLES + "cubism.jpg", outfiles, 1.0, [])
+    finally:
+        neuralstyle.algorithms.runalgorithm = original
+    assert stubalgorithm.calls == 1
+    for content, outfile in zip(contents, outfiles):
+        assert equalimages(content, outfile)
+
+
+def test_chenschmidt_grid_stub():
+    """Batched Chen-Schmidt jobs run one invocation per style, scale and width, producing all outputs with correct
+    shapes"""
+    tmpdir = TemporaryDirectory()
+    contents = [CONTENTS + "dockersmall.png", CONTENTS + "avila-walls.jpg"]
+    grid = jobgrid(contents, [STYLES + "cubism.jpg", STYLES + "munch.jpg"], tmpdir.name, "chen-schmidt", [None],
+                   [1.0])
+    original, neuralstyle.algorithms.runalgorithm = neuralstyle.algorithms.runalgorithm, stubalgorithm
+    stubalgorithm.calls = 0
+    stubalgorithm.sizes = []
+    try:
+        jobs = chenschmidt_grid(grid, None, "chen-schmidt", 100, [])
+    finally:
+        neuralstyle.algorithms.runalgorithm = original
+    widths = set(maxsize for maxsize, _ in stubalgorithm.sizes)
+    assert stubalgorithm.calls == 2 * len(widths)
+    for maxsize, contentwidths in stubalgorithm.sizes:
+        assert all(width == maxsize for width in contentwidths)
+    assert len(jobs) == 4
+    for spec in grid:
+        assert shape(spec["outfile"]) == shape(spec["content"])
+
+
+def test_isoutofmemory():
+    """Out of memory errors are told apart from other errors"""
+    assert isoutofmemory("THCudaCheck FAIL file=lib/THC/generic/THCStorage.cu line=66 error=2 : out of memory")
+    assert isoutofmemory("cudnn.find failed with CUDNN_STATUS_ALLOC_FAILED")
+    assert not isoutofmemory("lua: cannot open <models/VGG_ILSVRC_19_layers.caffemodel>")
+
+
+def stubsmallgpu(alg, params):
+    """Stub for runalgorithm that runs out of memory for contents wider than 300 pixels, and else copies them"""
+    content = params[params.index("--content") + 1]
+    savedir = params[params.index("--save") + 1]
+    if shape(content)[0] > 300:
+        raise OutOfMemoryError("Stub out of memory")
+    copyfile(content, savedir + "/" + filename(content) + "_stylized.png")
+
+
+def test_oomretiling():
+    """Running out of memory leads to retrying with smaller tiles, and to learning a smaller tile limit"""
+    tmpdir = TemporaryDirectory()
+    patched = {"runalgorithm": stubsmallgpu, "OOM_BACKOFF": 0, "TILELIMITS_FILE": tmpdir.name + "/limits.json",
+               "TILELIMITS": None}
+    originals = {name: getattr(neuralstyle.algorithms, name) for name in patched}
+    for name, value in patched.items():
+        setattr(neuralstyle.algorithms, name, value)
+    try:
+        jobs = styletransfer([CONTENTS + "docker.png"], [STYLES + "cubism.jpg"], tmpdir.name, alg="chen-schmidt",
+                             batch=False)
+        assert jobs[0].oomretries > 0
+        assert neuralstyle.algorithms.maxtile("chen-schmidt") <= 300
+    finally:
+        for name, value in originals.items():
+            setattr(neuralstyle.algorithms, name, value)
+    assert shape(glob(tmpdir.name + "/docker*cubism*")[0]) == shape(CONTENTS + "docker.png")
+
+
+def test_tileworkspace_tilelimit():
+    """Learning a smaller tile limit does not change the workspace of a tiled job, so that it can still be resumed"""
+    tmpdir = TemporaryDirectory()
+    for name in ["content.png", "style.png"]:
+        with open(tmpdir.name + "/" + name, "w") as f:
+            f.write(name)
+    args = (tmpdir.name + "/checkpoints", tmpdir.name + "/content.png", tmpdir.name + "/style.png", 2000, 100,
+            "chen-schmidt", None, 1.0, [], False, None, None)
+    patched = {"TILELIMITS_FILE": tmpdir.name + "/limits.json", "TILELIMITS": None}
+    originals = {name: getattr(neuralstyle.algorithms, name) for name in patched}
+    for name, value in patched.items():
+        setattr(neuralstyle.algorithms, name, value)
+    try:
+        before = neuralstyle.algorithms.tileworkspace(*args).name
+        neuralstyle.algorithms.learntilelimit("chen-schmidt", 200)
+        assert neuralstyle.algorithms.tileworkspace(*args).name == before
+    finally:
+        for name, value in originals.items():
+            setattr(neuralstyle.algorithms, name, value)
+
+
 def test_neuraltile():
     """The neural tiling procedure can be run without issues"""
     tmpdir = TemporaryDirectory()
@@ -164,3 +316,133 @@ def test_alpha_tiling():
     assert len(glob(tmpdir.name + "/*dockersmall_cubism*")) == 1
     # Check correct that generated image are different
     assertalldifferent(tmpdir.name + "/*cubism*")
+
+
+class Preempted(Exception):
+    """Simulated interruption of a style transfer job"""
+    pass
+
+
+def test_neuraltile_resume():
+    """An interrupted tiled job resumes from its first unfinished tile, and its workspace is removed once complete"""
+    tmpdir = TemporaryDirectory()
+    checkpointdir = tmpdir.name + "/checkpoints"
+    stylized = []
+    interrupt = [True]
+
+    def stubalgorithm(alg, params):
+        """Copies the content, simulating an interruption after stylizing two tiles"""
+        if interrupt[0] and len(stylized) == 2:
+            raise Preempted()
+        content = params[params.index("--content") + 1]
+        savedir = params[params.index("--save") + 1]
+        copyfile(content, savedir + "/" + filename(content) + "_stylized.png")
+        stylized.append(content)
+
+    original = neuralstyle.algorithms.runalgorithm
+    neuralstyle.algorithms.runalgorithm = stubalgorithm
+    try:
+        args = (CONTENTS + "avila-walls.jpg", STYLES + "cubism.jpg", tmpdir.name + "/tiled.png")
+        kwargs = {"alg": "chen-schmidt", "size": 2000, "checkpointdir": checkpointdir}
+        try:
+            neuraltile(*args, **kwargs)
+            assert False
+        except Preempted:
+            pass
+        assert len(listdir(checkpointdir)) == 1
+        interrupt[0] = False
+        neuraltile(*args, **kwargs)
+    finally:
+        neuralstyle.algorithms.runalgorithm = original
+    xtiles, ytiles = neuralstyle.algorithms.tilegeometry(shape(tmpdir.name + "/tiled.png"), "chen-schmidt", 100)
+    assert len(stylized) == xtiles * ytiles
+    assert listdir(checkpointdir) == []
+
+
+def test_neuraltile_resume_adaptive():
+    """An interrupted tiled job with adaptive overlaps resumes from its saved layout"""
+    tmpdir = TemporaryDirectory()
+    checkpointdir = tmpdir.name + "/checkpoints"
+    stylized = []
+    interrupt = [True]
+
+    def stubalgorithm(alg, params):
+        """Copies the content, simulating an interruption after stylizing one tile"""
+        if interrupt[0] and len(stylized) == 1:
+            raise Preempted()
+        content = params[params.index("--content") + 1]
+        savedir = params[params.index("--save") + 1]
+        copyfile(content, savedir + "/" + filename(content) + "_stylized.png")
+        stylized.append(content)
+
+    original = neuralstyle.algorithms.runalgorithm
+    neuralstyle.algorithms.runalgorithm = stubalgorithm
+    try:
+        args = (CONTENTS + "avila-walls.jpg", STYLES + "cubism.jpg", tmpdir.name + "/tiled.png")
+        kwargs = {"alg": "chen-schmidt", "size": 2000, "adaptiveoverlap": True, "checkpointdir": checkpointdir}
+        try:
+            neuraltile(*args, **kwargs)
+            assert False
+        except Preempted:
+            pass
+        interrupt[0] = False
+        neuraltile(*args, **kwargs)
+    finally:
+        neuralstyle.algorithms.runalgorithm = original
+    xtiles, ytiles = neuralstyle.algorithms.tilegeometry(shape(tmpdir.name + "/tiled.png"), "chen-schmidt", 100)
+    assert len(stylized) == xtiles * ytiles
+    assert listdir(checkpointdir) == []
+
+
+def stubcopyalgorithm(runs):
+    """Returns a stub for runalgorithm that copies the content as result, recording each run in a list"""
+    def stubalgorithm(alg, params):
+        content = params[params.index("--content") + 1]
+        savedir = params[params.index("--save") + 1]
+        copyfile(content, savedir + "/" + filename(content) + "_stylized.png")
+        runs.append(content)
+    return stubalgorithm
+
+
+def test_styletransfer_resume():
+    """Jobs completed in a previous run with the same checkpoints folder are skipped"""
+    tmpdir = TemporaryDirectory()
+    checkpointdir = tmpdir.name + "/checkpoints"
+    runs = []
+    original = neuralstyle.algorithms.runalgorithm
+    neuralstyle.algorithms.runalgorithm = stubcopyalgorithm(runs)
+    try:
+        args = ([CONTENTS + "docker.png", CONTENTS + "dockersmall.png"], [STYLES + "cubism.jpg"], tmpdir.name)
+        kwargs = {"alg": "chen-schmidt", "batch": False, "checkpointdir": checkpointdir}
+        styletransfer(*args, **kwargs)
+        assert len(runs) == 2
+        jobs = styletransfer(*args, **kwargs)
+    finally:
+        neuralstyle.algorithms.runalgorithm = original
+    assert len(runs) == 2
+    assert [job.cachehits for job in jobs] == [1, 1]
+
+
+def test_styletransfer_dedup():
+    """Jobs over duplicated inputs run once, and results of previous runs are reused"""
+    tmpdir = TemporaryDirectory()
+    copyfile(CONTENTS + "docker.png", tmpdir.name + "/copy.png")
+    runs = []
+    original = neuralstyle.algorithms.runalgorithm, neuralstyle.fingerprints.INDEX_FILE, neuralstyle.fingerprints.INDEX
+    neuralstyle.algorithms.runalgorithm = stubcopyalgorithm(runs)
+    neuralstyle.fingerprints.INDEX_FILE = tmpdir.name + "/fingerprints.json"
+    neuralstyle.fingerprints.INDEX = None
+    try:
+        args = ([CONTENTS + "docker.png", tmpdir.name + "/copy.png"], [STYLES + "cubism.jpg"], tmpdir.name)
+        kwargs = {"alg": "chen-schmidt", "batch": False, "dedup": True}
+        jobs = styletransfer(*args, **kwargs)
+        assert len(runs) == 1
+        assert [job.cachehits for job in jobs] == [0, 1]
+        assert equalimages(jobs[0].outfile, jobs[1].outfile)
+        neuralstyle.fingerprints.INDEX = None
+        jobs = styletransfer(*args, **kwargs)
+    finally:
+        neuralstyle.algorithms.runalgorithm, neuralstyle.fingerprints.INDEX_FILE, neuralstyle.fingerprints.INDEX = \
+            original
+    assert len(runs) == 1
+    assert [job.cachehits for job in jobs] == [1, 1]
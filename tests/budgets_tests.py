@@ -0,0 +1,31 @@
+#
+# Tests for the budgets module
+#
+import numpy as np
+from neuralstyle.budgets import tiledetail, allocateiterations, MINITERFRACTION, MAXITERFRACTION
+
+
+def test_tiledetail():
+    """Detailed images score higher than flat ones"""
+    flat = np.full((64, 64, 4), 128, dtype=np.uint8)
+    gradient = np.zeros((64, 64, 4), dtype=np.uint8)
+    gradient[..., :3] = np.arange(64, dtype=np.uint8)[np.newaxis, :, np.newaxis] * 4
+    noisy = np.random.RandomState(0).randint(0, 256, size=(64, 64, 4)).astype(np.uint8)
+    assert tiledetail(flat) == 0
+    assert tiledetail(flat) < tiledetail(gradient) < tiledetail(noisy) <= 1
+
+
+def test_allocateiterations():
+    """Iterations are allocated in proportion to detail, within bounds, adding up to the budget"""
+    iterations = allocateiterations([0.1, 0.2, 0.4, 0.3], 500, 0.8)
+    assert sum(iterations) == 1600
+    assert iterations[0] < iterations[1] < iterations[3] < iterations[2]
+    assert all(MINITERFRACTION * 500 <= n <= MAXITERFRACTION * 500 for n in iterations)
+
+
+def test_allocateiterations_bounds():
+    """Iterations left over by tiles at the bounds are redistributed among the rest"""
+    iterations = allocateiterations([0, 0, 1, 1], 100, 0.7)
+    assert iterations == [25, 25, 115, 115]
+    # Equal scores give a uniform allocation
+    assert allocateiterations([0.5, 0.5], 100, 1.0) == [100, 100]
@@ -0,0 +1,71 @@
+#
+# Tests for the checkpoints module
+#
+import os
+import time
+from os import listdir
+from tempfile import TemporaryDirectory
+from neuralstyle.checkpoints import workspace, finished, markfinished, loadstate, savestate, complete, \
+    collectgarbage, filedigest, markjobcomplete, jobcomplete
+
+
+def test_workspace():
+    """The same work opens the same workspace, and different work a different one"""
+    tmpdir = TemporaryDirectory()
+    folder = workspace(tmpdir.name, "neuraltile", {"content": "abc", "size": 1000})
+    assert workspace(tmpdir.name, "neuraltile", {"size": 1000, "content": "abc"}) == folder
+    assert workspace(tmpdir.name, "neuraltile", {"content": "abc", "size": 2000}) != folder
+    assert len(listdir(tmpdir.name)) == 2
+
+
+def test_units():
+    """Finished units and resume state are recorded in the manifest"""
+    tmpdir = TemporaryDirectory()
+    folder = workspace(tmpdir.name, "neuraltile", {})
+    assert finished(folder, "tile_0") is None
+    result = tmpdir.name + "/result.png"
+    with open(result, "w") as f:
+        f.write("result")
+    markfinished(folder, "tile_0", result, step=3)
+    record = finished(folder, "tile_0")
+    assert record["file"] == folder + "/tile_0.png"
+    assert record["step"] == 3
+    assert filedigest(record["file"]) == filedigest(result)
+    assert loadstate(folder, "layout") is None
+    savestate(folder, "layout", {"xtiles": 2})
+    assert loadstate(folder, "layout") == {"xtiles": 2}
+
+
+def test_collectgarbage():
+    """Complete and abandoned workspaces are removed"""
+    tmpdir = TemporaryDirectory()
+    folder = workspace(tmpdir.name, "neuraltile", {"n": 1})
+    complete(folder)
+    assert not os.path.exists(folder)
+    abandoned = workspace(tmpdir.name, "neuraltile", {"n": 2})
+    recent = workspace(tmpdir.name, "neuraltile", {"n": 3})
+    os.utime(abandoned + "/manifest.json", (time.time() - 1000, time.time() - 1000))
+    collectgarbage(tmpdir.name, maxage=100)
+    assert listdir(tmpdir.name) == [os.path.basename(recent)]
+
+
+def test_jobcomplete():
+    """Complete jobs are recognized as long as their result is unmodified, and their records are eventually removed"""
+    tmpdir = TemporaryDirectory()
+    checkpointdir = tmpdir.name + "/checkpoints"
+    result = tmpdir.name + "/result.png"
+    with open(result, "w") as f:
+        f.write("result")
+    assert not jobcomplete(checkpointdir, "job", {"n": 1}, result)
+    markjobcomplete(checkpointdir, "job", {"n": 1}, result)
+    assert jobcomplete(checkpointdir, "job", {"n": 1}, result)
+    assert not jobcomplete(checkpointdir, "job", {"n": 2}, result)
+    with open(result, "w") as f:
+        f.write("modified result")
+    assert not jobcomplete(checkpointdir, "job", {"n": 1}, result)
+    collectgarbage(checkpointdir, maxage=100)
+    assert len(listdir(checkpointdir)) == 1
+    record = checkpointdir + "/" + listdir(checkpointdir)[0]
+    os.utime(record, (time.time() - 1000, time.time() - 1000))
+    collectgarbage(checkpointdir, maxage=100)
+    assert listdir(checkpointdir) == []
@@ -0,0 +1,84 @@
+#
+# Tests for the devices module
+#
+import os
+import sys
+import time
+import json
+import types
+from tempfile import TemporaryDirectory
+import neuralstyle.devices
+from neuralstyle.devices import parsedevices, override, devices, gpuname, gpuconfig, readsnapshot, writesnapshot, \
+    probe
+
+
+def test_parsedevices():
+    """Device specs describe CPU-only or simulated GPU inventories"""
+    assert parsedevices("cpu") == [{"index": None, "name": "CPU", "memory": None}]
+    assert parsedevices("Tesla K80:11439, GeForce GTX 970M") == [
+        {"index": 0, "name": "Tesla K80", "memory": 11439.0},
+        {"index": 1, "name": "GeForce GTX 970M", "memory": None}
+    ]
+
+
+def test_override():
+    """Overridden devices are used instead of probing"""
+    try:
+        override("Tesla K80:11439,Tesla K80:11439")
+        assert len(devices()) == 2
+        assert gpuname() == "Tesla K80"
+        override("cpu")
+        assert gpuname() == "CPU"
+    finally:
+        override(None)
+
+
+def test_snapshot():
+    """Snapshots of probed devices are valid only for a while, and for the same visible GPUs"""
+    tmpdir = TemporaryDirectory()
+    original = neuralstyle.devices.SNAPSHOT_FILE
+    neuralstyle.devices.SNAPSHOT_FILE = tmpdir.name + "/devices.json"
+    try:
+        assert readsnapshot() is None
+        writesnapshot([{"index": 0, "name": "Tesla K80", "memory": 11439}])
+        assert readsnapshot()[0]["name"] == "Tesla K80"
+        with open(neuralstyle.devices.SNAPSHOT_FILE) as f:
+            snapshot = json.load(f)
+        snapshot["timestamp"] = time.time() - 2 * neuralstyle.devices.SNAPSHOT_TTL
+        with open(neuralstyle.devices.SNAPSHOT_FILE, "w") as f:
+            json.dump(snapshot, f)
+        assert readsnapshot() is None
+    finally:
+        neuralstyle.devices.SNAPSHOT_FILE = original
+
+
+def test_emptyprobe():
+    """Probes finding no GPUs are not snapshotted, and empty snapshots are not valid"""
+    tmpdir = TemporaryDirectory()
+    original = neuralstyle.devices.SNAPSHOT_FILE
+    neuralstyle.devices.SNAPSHOT_FILE = tmpdir.name + "/devices.json"
+    originalgputil = sys.modules.get("GPUtil")
+    sys.modules["GPUtil"] = types.SimpleNamespace(getGPUs=lambda: [])
+    try:
+        assert probe() == []
+        assert not os.path.exists(neuralstyle.devices.SNAPSHOT_FILE)
+        writesnapshot([])
+        assert readsnapshot() is None
+    finally:
+        neuralstyle.devices.SNAPSHOT_FILE = original
+        if originalgputil is None:
+            del sys.modules["GPUtil"]
+        else:
+            sys.modules["GPUtil"] = originalgputil
+
+
+def test_gpuconfig():
+    """The GPU configuration is found regardless of the working directory"""
+    tmpdir = TemporaryDirectory()
+    cwd = os.getcwd()
+    try:
+        os.chdir(tmpdir.name)
+        neuralstyle.devices._GPUCONFIG = None
+        assert "default" in gpuconfig()
+    finally:
+        os.chdir(cwd)
@@ -0,0 +1,155 @@
+#
+# Tests for the distributed module
+#
+import os
+import shutil
+import time
+from multiprocessing import Process
+from tempfile import TemporaryDirectory
+from neuralstyle.distributed import publish, collect, cancel, work, releaseclaim, TaskError
+
+
+def stubrunner(task, outfile):
+    """Stub style transfer for tasks, that marks the tile contents as stylized with the task weight"""
+    with open(task["tile"]) as f:
+        content = f.read()
+    with open(outfile, "w") as f:
+        f.write("stylized %s with weight %s" % (content, task["weight"]))
+
+
+def failingrunner(task, outfile):
+    """Stub style transfer that always fails"""
+    raise ValueError("Stub failure")
+
+
+def removingrunner(task, outfile):
+    """Stub style transfer that removes the job folder of its task, as a coordinator giving up on the job would"""
+    shutil.rmtree(task["jobdir"])
+    raise ValueError("Stub failure")
+
+
+def maketiles(folder, n):
+    """Creates fake tile files for testing"""
+    tiles = []
+    for i in range(n):
+        tiles.append(folder + "/tile_%d.png" % i)
+        with open(tiles[-1], "w") as f:
+            f.write("tile %d" % i)
+    return tiles
+
+
+def test_distributed_workers():
+    """Several worker processes process all published tiles, and results are mapped back to their tile slots"""
+    tmpdir = TemporaryDirectory()
+    sharedir = tmpdir.name + "/shared"
+    tiles = maketiles(tmpdir.name, 8)
+    jobid = publish(sharedir, tiles, [None] * len(tiles), tiles[0], {"alg": "stub", "weight": 5.0})
+    workers = [Process(target=work, args=(sharedir, stubrunner), kwargs={"idletimeout": 1, "poll": 0.1})
+               for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    outfiles = [tmpdir.name + "/result_%d.png" % i for i in range(len(tiles))]
+    collect(sharedir, jobid, outfiles, poll=0.1)
+    for worker in workers:
+        worker.join()
+    for i, outfile in enumerate(outfiles):
+        with open(outfile) as f:
+            assert f.read() == "stylized tile %d with weight 5.0" % i
+    assert not os.path.exists(sharedir + "/" + jobid)
+
+
+def test_stale_claim():
+    """Stale claims are released by the coordinator, so that another worker can process the task"""
+    tmpdir = TemporaryDirectory()
+    sharedir = tmpdir.name + "/shared"
+    tiles = maketiles(tmpdir.name, 1)
+    jobid = publish(sharedir, tiles, [None], tiles[0], {"alg": "stub", "weight": 1.0})
+    # Simulate a worker that claimed the task and died long ago
+    claim = sharedir + "/" + jobid + "/claims/00000.claim"
+    with open(claim, "w") as f:
+        f.write("deadworker")
+    os.utime(claim, (time.time() - 1000, time.time() - 1000))
+    worker = Process(target=work, args=(sharedir, stubrunner), kwargs={"idletimeout": 3, "poll": 0.1})
+    worker.start()
+    collect(sharedir, jobid, [tmpdir.name + "/result.png"], timeout=10, poll=0.1)
+    worker.join()
+    with open(tmpdir.name + "/result.png") as f:
+        assert f.read() == "stylized tile 0 with weight 1.0"
+
+
+def test_task_error():
+    """Failures of workers are reported to the coordinator"""
+    tmpdir = TemporaryDirectory()
+    sharedir = tmpdir.name + "/shared"
+    tiles = maketiles(tmpdir.name, 2)
+    jobid = publish(sharedir, tiles, [None] * 2, tiles[0], {"alg": "stub", "weight": 1.0})
+    work(sharedir, failingrunner, idletimeout=0, poll=0.1)
+    try:
+        collect(sharedir, jobid, [tmpdir.name + "/a.png", tmpdir.name + "/b.png"], poll=0.1)
+        assert False
+    except TaskError as e:
+        assert "Stub failure" in str(e)
+    assert os.listdir(sharedir) == []
+
+
+def test_cancelled_job():
+    """Workers do not claim tasks of cancelled or abandoned jobs"""
+    tmpdir = TemporaryDirectory()
+    sharedir = tmpdir.name + "/shared"
+    tiles = maketiles(tmpdir.name, 2)
+    jobid = publish(sharedir, tiles, [None] * 2, tiles[0], {"alg": "stub", "weight": 1.0})
+    cancel(sharedir, jobid)
+    assert work(sharedir, stubrunner, idletimeout=0, poll=0.1) == 0
+    assert os.listdir(sharedir) == []
+    jobid = publish(sharedir, tiles, [None] * 2, tiles[0], {"alg": "stub", "weight": 1.0})
+    coordinator = sharedir + "/" + jobid + "/coordinator"
+    os.utime(coordinator, (time.time() - 1000, time.time() - 1000))
+    assert work(sharedir, stubrunner, idletimeout=0, poll=0.1) == 0
+
+
+def test_removed_job():
+    """Workers survive the removal of the job folder of the task they are processing"""
+    tmpdir = TemporaryDirectory()
+    sharedir = tmpdir.name + "/shared"
+    tiles = maketiles(tmpdir.name, 1)
+    publish(sharedir, tiles, [None], tiles[0], {"alg": "stub", "weight": 1.0})
+    assert work(sharedir, removingrunner, idletimeout=0, poll=0.1) == 1
+    assert os.listdir(sharedir) == []
+
+
+def test_collect_partial():
+    """Results are handed over as they arrive, so that they are kept even if the job later fails"""
+    tmpdir = TemporaryDirectory()
+    sharedir = tmpdir.name + "/shared"
+    tiles = maketiles(tmpdir.name, 2)
+    jobid = publish(sharedir, tiles, [None] * 2, tiles[0], {"alg": "stub", "weight": 1.0})
+
+    def secondfails(task, outfile):
+        """Stub style transfer that fails only for the second tile"""
+        if task["task"] == "00001":
+            raise ValueError("Stub failure")
+        stubrunner(task, outfile)
+
+    work(sharedir, secondfails, idletimeout=0, poll=0.1)
+    finished = []
+    outfiles = [tmpdir.name + "/a.png", tmpdir.name + "/b.png"]
+    try:
+        collect(sharedir, jobid, outfiles, poll=0.1, onresult=finished.append)
+        assert False
+    except TaskError:
+        pass
+    assert finished == [0]
+    with open(outfiles[0]) as f:
+        assert f.read() == "stylized tile 0 with weight 1.0"
+
+
+def test_releaseclaim():
+    """Workers only release their own claims, not those taken over by other workers"""
+    tmpdir = TemporaryDirectory()
+    claim = tmpdir.name + "/00000.claim"
+    with open(claim, "w") as f:
+        f.write("otherworker")
+    releaseclaim(claim, "staleworker")
+    assert os.path.exists(claim)
+    releaseclaim(claim, "otherworker")
+    assert not os.path.exists(claim)
@@ -0,0 +1,97 @@
+#
+# Tests for the fingerprints module
+#
+import numpy as np
+from tempfile import TemporaryDirectory
+from shutil import copyfile
+import neuralstyle.fingerprints
+from neuralstyle.fingerprints import pixeldigest, perceptualhash, hamming, dedupgrid, alphadigest, canonical, \
+    PHASH_THRESHOLD
+from neuralstyle.imagemagick import convert
+
+CONTENTS = "/app/entrypoint/tests/contents/"
+STYLES = "/app/entrypoint/tests/styles/"
+
+
+def smoothimage(seed, blocksize=25):
+    """Creates a smooth random RGBA image"""
+    colors = np.random.RandomState(seed).rand(12, 16, 3) * 255
+    rgb = np.kron(colors, np.ones((blocksize, blocksize, 1)))
+    return np.concatenate([rgb, np.full(rgb.shape[:2] + (1,), 255)], axis=2).astype(np.uint8)
+
+
+def test_pixeldigest():
+    """Equal pixels produce equal digests"""
+    image = smoothimage(0)
+    assert pixeldigest(image) == pixeldigest(image.copy())
+    assert pixeldigest(image) != pixeldigest(smoothimage(1))
+
+
+def test_perceptualhash():
+    """Perceptual hashes are robust to noise and resizing, but tell different images apart"""
+    image = smoothimage(0)
+    noisy = np.clip(image + np.random.RandomState(0).randint(-8, 9, image.shape), 0, 255).astype(np.uint8)
+    assert len(perceptualhash(image)) == 16
+    assert hamming(perceptualhash(image), perceptualhash(noisy)) <= PHASH_THRESHOLD
+    assert hamming(perceptualhash(image), perceptualhash(smoothimage(0, blocksize=10))) <= PHASH_THRESHOLD
+    assert hamming(perceptualhash(image), perceptualhash(smoothimage(1))) > PHASH_THRESHOLD
+
+
+def test_alphadigest():
+    """Opaque images have no alpha digest, and different transparencies have different digests"""
+    image = smoothimage(0)
+    assert alphadigest(image) is None
+    transparent = image.copy()
+    transparent[:100, :, 3] = 0
+    assert alphadigest(transparent) is not None
+    assert alphadigest(transparent) == alphadigest(transparent.copy())
+    assert alphadigest(transparent) != alphadigest(transparent[::-1])
+
+
+def test_canonical_alpha():
+    """Near duplicates with the same colors but different transparency are not considered the same image"""
+    tmpdir = TemporaryDirectory()
+    image = smoothimage(0)
+    transparent = image.copy()
+    transparent[:100, :, 3] = 0
+    noisy = np.clip(image + np.random.RandomState(0).randint(-8, 9, image.shape), 0, 255).astype(np.uint8)
+    noisy[..., 3] = 255
+    images = {tmpdir.name + "/" + name: pixels for name, pixels in
+              [("image.png", image), ("noisy.png", noisy), ("transparent.png", transparent)]}
+    for name in images:
+        with open(name, "w") as f:
+            f.write(name)
+    original = neuralstyle.fingerprints.INDEX_FILE, neuralstyle.fingerprints.INDEX, neuralstyle.fingerprints.readimage
+    neuralstyle.fingerprints.INDEX_FILE, neuralstyle.fingerprints.INDEX = tmpdir.name + "/index.json", None
+    neuralstyle.fingerprints.readimage = images.get
+    try:
+        mapping = canonical(sorted(images), perceptual=True)
+    finally:
+        neuralstyle.fingerprints.INDEX_FILE, neuralstyle.fingerprints.INDEX, neuralstyle.fingerprints.readimage = \
+            original
+    assert mapping[tmpdir.name + "/noisy.png"] == tmpdir.name + "/image.png"
+    assert mapping[tmpdir.name + "/transparent.png"] == tmpdir.name + "/transparent.png"
+
+
+def test_hamming():
+    """Hamming distances between hashes are computed correctly"""
+    assert hamming("00ff", "00ff") == 0
+    assert hamming("00ff", "01fe") == 2
+
+
+def test_dedupgrid():
+    """Jobs over copies of the same image, even in different formats, are detected as duplicates"""
+    tmpdir = TemporaryDirectory()
+    original = neuralstyle.fingerprints.INDEX_FILE, neuralstyle.fingerprints.INDEX
+    neuralstyle.fingerprints.INDEX_FILE, neuralstyle.fingerprints.INDEX = tmpdir.name + "/index.json", None
+    try:
+        copyfile(CONTENTS + "docker.png", tmpdir.name + "/copy.png")
+        convert(CONTENTS + "docker.png", tmpdir.name + "/copy.bmp")
+        grid = [{"content": content, "style": STYLES + "cubism.jpg", "weight": 5.0, "stylescale": 1.0}
+                for content in [CONTENTS + "docker.png", tmpdir.name + "/copy.png", tmpdir.name + "/copy.bmp",
+                                CONTENTS + "goldengate.jpg"]]
+        unique, duplicates = dedupgrid(grid)
+        assert unique == [grid[0], grid[3]]
+        assert duplicates == [(grid[1], grid[0]), (grid[2], grid[0])]
+    finally:
+        neuralstyle.fingerprints.INDEX_FILE, neuralstyle.fingerprints.INDEX = original
@@ -0,0 +1,53 @@
+#
+# Tests for the metrics module
+#
+import json
+from tempfile import TemporaryDirectory
+from neuralstyle.metrics import JobMetrics, trackjob, record, registerworkdir, sampledisk, appendledger, \
+    writeprometheus, active
+
+
+def test_trackjob_record():
+    """Usage recorded inside a tracked job is charged to that job, and ignored outside of it"""
+    job = JobMetrics("out.png", "content.png", "style.png", "gatys", 5.0, 1.0)
+    record(tiles=3)
+    with trackjob(job):
+        assert active() is job
+        record(tiles=2, gpuseconds=1.5)
+        record(multiresolutionsteps=1)
+    record(tiles=3)
+    assert active() is None
+    assert job.tiles == 2
+    assert job.gpuseconds == 1.5
+    assert job.multiresolutionsteps == 1
+    assert job.wallseconds > 0
+
+
+def test_sampledisk():
+    """Peak disk usage of registered work folders is measured"""
+    tmpdir = TemporaryDirectory()
+    job = JobMetrics("out.png", "content.png", "style.png", "gatys")
+    with trackjob(job):
+        registerworkdir(tmpdir.name)
+        with open(tmpdir.name + "/data.bin", "wb") as f:
+            f.write(b"0" * 1000)
+        sampledisk()
+    assert job.peakdiskbytes == 1000
+
+
+def test_ledger_prometheus():
+    """Job metrics can be exported to a JSONL ledger and a Prometheus textfile"""
+    tmpdir = TemporaryDirectory()
+    jobs = [JobMetrics("out%d.png" % i, "content.png", "style.png", "gatys") for i in range(2)]
+    for job in jobs:
+        job.gpuseconds = 10
+        appendledger(tmpdir.name + "/ledger.jsonl", job)
+    with open(tmpdir.name + "/ledger.jsonl") as f:
+        lines = [json.loads(line) for line in f]
+    assert [line["outfile"] for line in lines] == ["out0.png", "out1.png"]
+
+    writeprometheus(tmpdir.name + "/metrics.prom", jobs)
+    with open(tmpdir.name + "/metrics.prom") as f:
+        text = f.read()
+    assert 'neuralstyle_last_run_gpu_seconds{alg="gatys"} 20' in text
+    assert 'neuralstyle_last_run_jobs{alg="gatys"} 2' in text
@@ -0,0 +1,55 @@
+#
+# Tests for the outputs module
+#
+from tempfile import TemporaryDirectory
+from shutil import copyfile
+from neuralstyle.outputs import parseoutput, variantname, checkoutputs, encodeoutputs
+from neuralstyle.imagemagick import shape
+
+CONTENTS = "/app/entrypoint/tests/contents/"
+
+
+def test_parseoutput():
+    """Output spec strings are parsed into dictionaries"""
+    assert parseoutput("png") == {"format": "png", "quality": None, "maxsize": None, "stripalpha": False}
+    assert parseoutput("webp:q80:max512:noalpha") == {"format": "webp", "quality": 80, "maxsize": 512,
+                                                      "stripalpha": True}
+    for wrong in ["", "jpg:big"]:
+        try:
+            parseoutput(wrong)
+            assert False
+        except ValueError:
+            pass
+
+
+def test_variantname():
+    """Variant names reflect their options"""
+    assert variantname("/out/a_b_gatys.png", parseoutput("jpg:q85:max1024")) == "/out/a_b_gatys_max1024_q85.jpg"
+    assert variantname("/out/a_b_gatys.png", parseoutput("png:noalpha")) == "/out/a_b_gatys_noalpha.png"
+
+
+def test_checkoutputs():
+    """Output specs overwriting the result or each other are rejected"""
+    outputs, names = checkoutputs("/out/a_b_gatys.png", ["jpg", "jpg:noalpha"])
+    assert names == ["/out/a_b_gatys.jpg", "/out/a_b_gatys_noalpha.jpg"]
+    for wrong in [["png"], ["jpg:q80", "jpg:q80"]]:
+        try:
+            checkoutputs("/out/a_b_gatys.png", wrong)
+            assert False
+        except ValueError:
+            pass
+
+
+def test_encodeoutputs():
+    """All variants are encoded from a single result"""
+    tmpdir = TemporaryDirectory()
+    outfile = tmpdir.name + "/docker.png"
+    copyfile(CONTENTS + "docker.png", outfile)
+    variants = encodeoutputs(outfile, ["jpg:q85", "webp:max200"])
+    assert [variant["file"] for variant in variants] == [tmpdir.name + "/docker_q85.jpg",
+                                                         tmpdir.name + "/docker_max200.webp"]
+    assert shape(variants[0]["file"]) == shape(outfile)
+    assert max(shape(variants[1]["file"])) == 200
+    for variant in variants:
+        assert variant["seconds"] > 0
+        assert variant["bytes"] > 0
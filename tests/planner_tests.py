@@ -0,0 +1,81 @@
+#
+# Tests for the planner module
+#
+import json
+from tempfile import TemporaryDirectory
+from neuralstyle.planner import makeplan, algorithmpasses, estimate, sweepchains, calibrate, COSTMODEL
+
+CONTENTS = "/app/entrypoint/tests/contents/"
+STYLES = "/app/entrypoint/tests/styles/"
+
+
+def test_makeplan():
+    """A plan lists all jobs of a grid, with tiling layouts and estimates"""
+    tmpdir = TemporaryDirectory()
+    plan = makeplan([CONTENTS + "dockersmall.png", CONTENTS + "goldengate.jpg"], [STYLES + "cubism.jpg"],
+                    tmpdir.name, alg="gatys", weights=[1, 5])
+    assert plan["totals"]["jobs"] == 4
+    assert [job["tiling"] is None for job in plan["jobs"]] == [True, True, False, False]
+    for job in plan["jobs"]:
+        assert job["estimatedseconds"] > 0
+        assert job["estimatedpeakmemory"] > 0
+    json.dumps(plan)
+
+
+def test_makeplan_shortestfirst():
+    """Plans can be sorted by estimated runtime, keeping sweeps together"""
+    tmpdir = TemporaryDirectory()
+    plan = makeplan([CONTENTS + "goldengate.jpg", CONTENTS + "dockersmall.png"], [STYLES + "cubism.jpg"],
+                    tmpdir.name, alg="gatys", weights=[1, 5], sweep=True, shortestfirst=True)
+    assert [job["content"] for job in plan["jobs"]] == [CONTENTS + "dockersmall.png"] * 2 + \
+                                                       [CONTENTS + "goldengate.jpg"] * 2
+    assert [job["initimage"] is None for job in plan["jobs"]] == [True, False, True, False]
+
+
+def test_algorithmpasses():
+    """Algorithm passes reflect iterations, warm starts and multiresolution steps"""
+    assert algorithmpasses("gatys", [512, 512], ["-num_iterations", "200"]) == \
+        [{"shape": [512, 512], "iterations": 200}]
+    assert algorithmpasses("gatys", [512, 512], [], warmstart=True) == [{"shape": [512, 512], "iterations": 150}]
+    assert algorithmpasses("gatys", [512, 512], ["-num_iterations", "200"], iterbudget=0.7) == \
+        [{"shape": [512, 512], "iterations": 140}]
+    assert algorithmpasses("chen-schmidt", [512, 256], []) == [{"shape": [512, 256], "iterations": None}]
+    assert len(algorithmpasses("gatys-multiresolution", [512, 256], [])) == 35
+
+
+def test_estimate():
+    """Runtime estimates grow with the number of pixels and iterations"""
+    small, smallmemory = estimate("gatys", [{"shape": [256, 256], "iterations": 500}], COSTMODEL)
+    large, largememory = estimate("gatys", [{"shape": [512, 512], "iterations": 500}], COSTMODEL)
+    assert small < large
+    assert smallmemory < largememory
+    batched, _ = estimate("chen-schmidt", [{"shape": [512, 512], "iterations": None}], COSTMODEL, startup=False)
+    single, _ = estimate("chen-schmidt", [{"shape": [512, 512], "iterations": None}], COSTMODEL)
+    assert single - batched == COSTMODEL["chen-schmidt"]["startup"]
+
+
+def test_makeplan_batch():
+    """Batched Chen-Schmidt jobs share the startup of each batch"""
+    tmpdir = TemporaryDirectory()
+    args = ([CONTENTS + "dockersmall.png", CONTENTS + "dockersmall.png"], [STYLES + "cubism.jpg"], tmpdir.name)
+    batched = makeplan(*args, alg="chen-schmidt")
+    unbatched = makeplan(*args, alg="chen-schmidt", batch=False)
+    startup = COSTMODEL["chen-schmidt"]["startup"]
+    assert abs(unbatched["totals"]["estimatedseconds"] - batched["totals"]["estimatedseconds"] - startup) < 1e-6
+
+
+def test_sweepchains():
+    """Jobs warm started from the previous one are kept in the same chain"""
+    jobs = [{"initimage": None}, {"initimage": "a"}, {"initimage": None}, {"initimage": None}, {"initimage": "b"}]
+    assert [len(chain) for chain in sweepchains(jobs)] == [2, 1, 2]
+
+
+def test_calibrate():
+    """Calibration rescales the cost model to match measured runtimes"""
+    tmpdir = TemporaryDirectory()
+    plan = {"alg": "gatys", "jobs": [{"outfile": "a.png", "estimatedseconds": 100.0}]}
+    with open(tmpdir.name + "/ledger.jsonl", "w") as f:
+        f.write(json.dumps({"outfile": "a.png", "gpuseconds": 200.0}) + "\n")
+    calibrated = calibrate(plan, tmpdir.name + "/ledger.jsonl")
+    assert calibrated["gatys"]["seconds"] == 2 * COSTMODEL["gatys"]["seconds"]
+    assert calibrated["chen-schmidt"] == COSTMODEL["chen-schmidt"]
@@ -0,0 +1,71 @@
+#
+# Tests for the seams module
+#
+import json
+import numpy as np
+from neuralstyle.seams import cutpositions, adaptivetiles, minimumseam, quilt
+
+
+def test_cutpositions():
+    """Cuts between tiles are placed at the center of the overlaps of a uniform tiling"""
+    # 2 tiles of 550 pixels overlapping by 100 pixels cover 1000 pixels, overlap centered at 500
+    assert cutpositions(1000, 2, 100) == [500]
+    assert cutpositions(1000, 1, 100) == []
+
+
+def test_adaptivetiles_flat():
+    """A flat image is tiled with the minimum overlap, a detailed image with the maximum overlap"""
+    flat = np.zeros((400, 600, 4), dtype=np.uint8)
+    boxes, overlaps = adaptivetiles(flat, 2, 2, maxoverlap=100, minoverlap=16)
+    assert len(boxes) == 4
+    assert overlaps == [(0, 0), (16, 0), (0, 16), (16, 16)]
+
+    rng = np.random.RandomState(0)
+    detailed = rng.randint(0, 256, size=(400, 600, 4)).astype(np.uint8)
+    noisy = np.zeros((400, 600, 4), dtype=np.uint8)
+    noisy[:, 250:350] = detailed[:, 250:350]
+    noisy[150:250, :] = detailed[150:250, :]
+    boxes, overlaps = adaptivetiles(noisy, 2, 2, maxoverlap=100, minoverlap=16)
+    assert overlaps == [(0, 0), (100, 0), (0, 100), (100, 100)]
+    # With maximum overlaps the layout reproduces a uniform tiling: 2 tiles of 350 pixels, 2 tiles of 250 pixels
+    assert boxes == [(0, 0, 350, 250), (250, 0, 350, 250), (0, 150, 350, 250), (250, 150, 350, 250)]
+
+
+def test_adaptivetiles_coverage():
+    """Adaptive tiles cover the whole image and never grow beyond the uniform tiling"""
+    rng = np.random.RandomState(0)
+    pixels = np.zeros((500, 700, 4), dtype=np.uint8)
+    pixels[100:300, 300:500] = rng.randint(0, 256, size=(200, 200, 4))
+    boxes, overlaps = adaptivetiles(pixels, 3, 2, maxoverlap=80)
+    covered = np.zeros((500, 700), dtype=bool)
+    for x, y, w, h in boxes:
+        assert w <= (700 + 2 * 80) / 3 + 1
+        assert h <= (500 + 80) / 2 + 1
+        covered[y:y+h, x:x+w] = True
+    assert covered.all()
+
+
+def test_adaptivetiles_json():
+    """Adaptive layouts are made of plain integers, so that they can be saved in checkpoint manifests"""
+    rng = np.random.RandomState(0)
+    pixels = rng.randint(0, 256, size=(300, 400, 4)).astype(np.uint8)
+    boxes, overlaps = adaptivetiles(pixels, 2, 2, maxoverlap=60)
+    assert json.loads(json.dumps({"boxes": boxes, "overlaps": overlaps})) == {
+        "boxes": [list(box) for box in boxes], "overlaps": [list(overlap) for overlap in overlaps]}
+
+
+def test_minimumseam():
+    """The minimum seam follows the cheapest path through a cost matrix"""
+    cost = np.ones((5, 4))
+    for i, j in enumerate([0, 1, 2, 2, 3]):
+        cost[i, j] = 0
+    assert list(minimumseam(cost)) == [0, 1, 2, 2, 3]
+
+
+def test_quilt_reconstruction():
+    """Quilting tiles cropped from an image reconstructs the original image"""
+    rng = np.random.RandomState(0)
+    pixels = rng.randint(0, 256, size=(200, 300, 4)).astype(np.uint8)
+    boxes, overlaps = adaptivetiles(pixels, 2, 2, maxoverlap=40)
+    tiles = [pixels[y:y+h, x:x+w] for x, y, w, h in boxes]
+    assert (quilt(tiles, boxes, overlaps, [300, 200]) == pixels).all()